@@ -1,15 +1,16 @@
 import time
-import asyncio
 import os
 import streamlit as st
-import pandas as pd
 from datetime import date, datetime, timedelta
 
 import config
+import client
 import fetchers
 import charts
 import helpers
+import store
 from header.header import header
+from nakaflow.nakamoto import GRANULARITIES, nakamoto_column, period_heights
 
 
 st.set_page_config(page_icon="⛓️", layout="wide")
@@ -53,7 +54,7 @@ with st.expander("⚙️ Query Parameters", expanded=False):
         to_unix = int(datetime.timestamp(datetime.strptime(
             f"{to_date} {to_time}", "%Y-%m-%d %H:%M:%S")))
 
-quantitative_df = asyncio.run(fetchers.get_snapshots(network, frequency, from_unix, to_unix))
+quantitative_df = client.run(fetchers.get_snapshots(network, frequency, from_unix, to_unix))
 
 if len(quantitative_df.index) != 0:
     with st.container():
@@ -74,11 +75,25 @@ if len(quantitative_df.index) != 0:
             col1, col2, col3 = st.columns([5, 1, 1])
             with col1:
                 st.markdown(f'#### Network: {network}')
+
+                watermark = store.snapshot_watermark(network, frequency)
+                if watermark and watermark['max_timestamp']:
+                    st.caption(
+                        f"Latest {frequency} snapshot {datetime.utcfromtimestamp(watermark['max_timestamp'])} UTC "
+                        f"at block {watermark['block_height']}, refreshed "
+                        f"{datetime.utcfromtimestamp(watermark['updated']).strftime('%Y-%m-%d %H:%M')} UTC")
             with col2:
                 helpers.data_download_button(
                     quantitative_df, f"{network}_{frequency}", label=f"📥 Download {network} snapshot")
             with col3:
-                st.button(btn_text, disabled=btn_disabled, on_click=fetchers.refresh_snapshots)
+                if config.external_refresher:
+                    # ingestion belongs to refresher.py, the dashboard only reads its status
+                    refresher_status = store.read_refresher_status().get(frequency, {})
+                    if refresher_status.get('next_run'):
+                        st.caption(f"{frequency.capitalize()} refresh {refresher_status['state']}, next at "
+                                   f"{datetime.utcfromtimestamp(refresher_status['next_run']).strftime('%H:%M')} UTC")
+                else:
+                    st.button(btn_text, disabled=btn_disabled, on_click=fetchers.refresh_snapshots)
 
             st.markdown('---')
 
@@ -334,7 +349,7 @@ if len(quantitative_df.index) != 0:
             block_number = st.text_input('Enter block number', latest_snapshot['blockHeight'].iloc[0])
             block_author = ''
             if block_number != "" and block_number.isnumeric():
-                block_df = asyncio.run(fetchers.get_block_snapshot(network, block_number))
+                block_df = client.run(fetchers.get_block_snapshot(network, block_number))
 
                 if not block_df.empty:
                     col1, col2 = st.columns([1, 4])
@@ -375,7 +390,7 @@ if len(quantitative_df.index) != 0:
 
             author_id = st.text_input('Enter author address', block_author)
             if author_id != "":
-                author_df = asyncio.run(fetchers.get_author_snapshot(network, author_id))
+                author_df = client.run(fetchers.get_author_snapshot(network, author_id))
 
                 if not author_df.empty:
                     col1, col2 = st.columns([4, 1])
@@ -387,106 +402,92 @@ if len(quantitative_df.index) != 0:
                 else:
                     st.warning('No Data')
 
-    holder = st.empty()
-    try:
-        with holder.expander("✳️ Nakamoto Coefficients"):
-            with st.container():
-                data = quantitative_df[['blockHeight', 'datetime']]
-
-                data['day'] = data["datetime"].apply(lambda x: x.strftime("%d"))
-                blocks = data[data["day"] == '01']["blockHeight"].tolist()
-
-                author_df = fetchers.author_data(network, config.deployments[network], blocks)
-                # st.write(author_df)
-
-                # author_df = asyncio.run(fetchers.get_author_snapshots(network, blocks))
-                # st.write(author_df)
-
-                block_timestamp_dict = (
-                    data[["blockHeight", "datetime"]]
-                    .set_index("blockHeight")
-                    .to_dict()
-                )
-                author_df["datetime"] = author_df["height"].apply(
-                    lambda x: block_timestamp_dict["datetime"][x]
-                )
-
-                author_df = author_df.set_index(["network", "height", "datetime", "id"])  # set index as (height, id)
-                author_df = author_df.unstack()  # Move index id to columns
-                author_df = author_df.swaplevel(axis=1).sort_index(axis=1)  # swap & sort column
-                author_df = author_df.diff()  # get diff over time
-                author_df = author_df.xs("cumulativeBlocksCreated", axis=1, level=1)  # grab blocks created
-                author_df = author_df.iloc[1:]  # drop the first one
-
-                tmp_list = []
-                for idx, row in author_df.iterrows():
-                    # TODO, drop 0s from row
-                    row = row[row > 0]
-
-                    author_count = len(row)
-
-                    # get stats about block mining
-                    blocks_mined_total = row.sum()
-                    blocks_mined_median = row.median()
-                    blocks_mined_mean = row.mean()
-
-                    blocks_mined_max = row.max()
-                    blocks_mined_min = row.min()
-
-                    blocks_mined_std = row.std()
-
-                    blocks_mined_q3 = row.quantile(0.75)
-                    blocks_mined_q1 = row.quantile(0.25)
-
-                    # Getting realized nakamoto
-                    authored = row.sort_values(ascending=False).to_frame(name="authored")
-                    authored["authored.cumulative"] = authored["authored"].cumsum()
-                    authored["pct"] = authored["authored"] / blocks_mined_total
-                    authored["pct.cumulative"] = authored["pct"].cumsum()
-
-                    realized_nakamoto = (
-                        len(authored[authored["pct.cumulative"] < 0.33]) + 1
-                    )
-
-                    # NOTE: consider normalizing this to pct so the charts are simplier
-                    tmp_dict = {
-                        "network": idx[0],
-                        "date": idx[2].strftime("%Y-%m-%d"),
-                        "author_count": author_count,
-                        "nakamoto_realized": realized_nakamoto,
-                        "blocksAuthored_sum": blocks_mined_total,
-                        "blocksAuthored_mean": blocks_mined_mean,
-                        "blocksAuthored_median": blocks_mined_median,
-                        "blocksAuthored_max": blocks_mined_max,
-                        "blocksAuthored_min": blocks_mined_min,
-                        "blocksAuthored_std": blocks_mined_std,
-                        "blocksAuthored_q3": blocks_mined_q3,
-                        "blocksAuthored_q1": blocks_mined_q1,
-                    }
-                    tmp_list.append(tmp_dict)
-
-                author_stats = pd.DataFrame(tmp_list)
-
-            with st.container():
-                tab1, tab2 = st.tabs(["📈 Chart", "🗃 Data"])
-                with tab1:
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.markdown('##### Realized Nakamoto')
+    with st.expander("✳️ Nakamoto Coefficients"):
+        with st.container():
+            data = quantitative_df[['blockHeight', 'datetime']]
 
-                        metric_on_y = 'nakamoto_realized'
-                        metric_on_x = 'date'
-                        data = author_stats[['network', metric_on_y, metric_on_x]]
+            col1, col2, col3 = st.columns([2, 2, 3])
+            with col1:
+                granularity = st.selectbox('Period', GRANULARITIES, format_func=lambda x: (
+                    'every N blocks' if x == 'blocks' else x))
+            with col2:
+                every_n_blocks = st.number_input(
+                    'N blocks', min_value=1, value=100000, step=10000, disabled=granularity != 'blocks')
+            with col3:
+                fast_mode = st.checkbox(
+                    'Fast mode (realized Nakamoto only)', help='Only fetches the largest authors of each period')
 
-                        charts.plot_line(data, metric_on_y, metric_on_x, None)
-                    with col2:
-                        st.markdown('##### Blocks Authored')
+            blocks = period_heights(data, granularity, every_n_blocks=int(every_n_blocks))
 
-                        charts.plot_box(author_stats, 'blocksAuthored', 'date', 'sum')
-                with tab2:
-                    helpers.data_grid(author_stats)
-                    helpers.data_download_button(author_stats, 'prefix')
-    except:
-        holder.empty()
+        holder = st.empty()
+        if len(blocks) < 2:
+            holder.info('Not enough periods in the time range, pick a wider range or a shorter period')
+        else:
+            try:
+                with holder.container():
+                    with st.container():
+                        if fast_mode:
+                            author_stats = fetchers.author_period_nakamoto(
+                                network, blocks, threshold=config.nakamoto_thresholds[0])
+                        else:
+                            progress_bar = st.progress(0)
+                            author_stats = fetchers.author_period_stats(
+                                network, blocks, thresholds=config.nakamoto_thresholds,
+                                progress=lambda done, total: progress_bar.progress(
+                                    done / total, text=f'Fetched authors at {done} of {total} new heights'))
+                            progress_bar.empty()
+
+                        block_timestamp_dict = (
+                            data[["blockHeight", "datetime"]]
+                            .set_index("blockHeight")
+                            .to_dict()
+                        )
+                        author_stats["date"] = author_stats["height"].apply(
+                            lambda x: block_timestamp_dict["datetime"][x].strftime("%Y-%m-%d")
+                        )
+
+                        author_stats = author_stats.rename({
+                            "sum": "blocksAuthored_sum",
+                            "mean": "blocksAuthored_mean",
+                            "median": "blocksAuthored_median",
+                            "max": "blocksAuthored_max",
+                            "min": "blocksAuthored_min",
+                            "std": "blocksAuthored_std",
+                            "q3": "blocksAuthored_q3",
+                            "q1": "blocksAuthored_q1",
+                        }, axis='columns')
+                        author_stats = author_stats[[
+                            "network", "date", "nakamoto_realized"
+                        ]] if fast_mode else author_stats[[
+                            "network", "date", "author_count", "nakamoto_realized",
+                            *[nakamoto_column(threshold) for threshold in config.nakamoto_thresholds], "gini", "hhi",
+                            "blocksAuthored_sum", "blocksAuthored_mean", "blocksAuthored_median", "blocksAuthored_max",
+                            "blocksAuthored_min", "blocksAuthored_std", "blocksAuthored_q3", "blocksAuthored_q1",
+                        ]]
+
+                    with st.container():
+                        tab1, tab2 = st.tabs(["📈 Chart", "🗃 Data"])
+                        with tab1:
+                            col1, col2 = st.columns(2)
+                            with col1:
+                                st.markdown('##### Realized Nakamoto')
+
+                                metric_on_y = 'nakamoto_realized' if fast_mode else st.selectbox(
+                                    'Concentration',
+                                    [nakamoto_column(threshold) for threshold in config.nakamoto_thresholds] + ['gini', 'hhi'])
+                                metric_on_x = 'date'
+                                data = author_stats[['network', metric_on_y, metric_on_x]]
+
+                                charts.plot_line(data, metric_on_y, metric_on_x, None)
+                            if not fast_mode:
+                                with col2:
+                                    st.markdown('##### Blocks Authored')
+
+                                    charts.plot_box(author_stats, 'blocksAuthored', 'date', 'sum')
+                        with tab2:
+                            helpers.data_grid(author_stats)
+                            helpers.data_download_button(author_stats, 'prefix')
+            except:
+                holder.empty()
 else:
     st.warning('No Data in Time Range')
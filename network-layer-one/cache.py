@@ -0,0 +1,49 @@
+import logging
+import threading
+from collections import OrderedDict
+
+import config
+
+
+class FrameCache:
+    # LRU of dataframes bounded by their memory usage, shared by every session in the process;
+    # entries carry a version and are only returned while the caller's version matches
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.frames = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.frames.get(key)
+            if entry is None or entry[0] != version:
+                return None
+
+            self.frames.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, version, df):
+        nbytes = int(df.memory_usage(deep=True).sum())
+
+        with self.lock:
+            self._pop(key)
+            if nbytes > self.max_bytes:
+                logging.warning(f">> {key} frame ({nbytes} bytes) exceeds the cache budget, not caching")
+                return
+
+            self.frames[key] = (version, df, nbytes)
+            self.size += nbytes
+
+            while self.size > self.max_bytes:
+                evicted, (_, _, evicted_bytes) = self.frames.popitem(last=False)
+                self.size -= evicted_bytes
+                logging.info(f">> evicted {evicted} frame from cache")
+
+    def _pop(self, key):
+        entry = self.frames.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+
+snapshots = FrameCache(config.snapshot_cache_max_bytes)
@@ -0,0 +1,71 @@
+import atexit
+import asyncio
+import logging
+import threading
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+import config
+
+
+class Client:
+    # owns an event loop on a background thread and one pooled keep-alive session on it,
+    # so every streamlit rerun reuses the same connections instead of calling asyncio.run
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="fetchers-client", daemon=True)
+        self.thread.start()
+
+        self.session = self.run(self.open_session())
+
+    async def open_session(self):
+        connector = TCPConnector(
+            limit=config.client_connection_limit,
+            limit_per_host=config.client_connection_limit_per_host,
+            keepalive_timeout=config.client_keepalive_timeout,
+            ttl_dns_cache=config.client_dns_cache_ttl,
+        )
+
+        return ClientSession(connector=connector, timeout=ClientTimeout(total=config.client_request_timeout))
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        return self.submit(coro).result(timeout)
+
+    def close(self):
+        if not self.loop.is_running():
+            return
+
+        self.run(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+        logging.info(">> closed fetchers client")
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+
+    with _client_lock:
+        if _client is None:
+            _client = Client()
+            atexit.register(_client.close)
+
+        return _client
+
+
+def submit(coro):
+    return get_client().submit(coro)
+
+
+def run(coro, timeout=None):
+    return get_client().run(coro, timeout)
+
+
+def session():
+    return get_client().session
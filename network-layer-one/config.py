@@ -46,3 +46,63 @@ metrics_without_stats = ["network", "blockHeight",
                          "blocks", "timestamp", "datetime", "totalSupply", "gasPrice"]
 metrics_with_stats = ["UniqueAuthors", "Difficulty", "GasUsed", "GasLimit", "BurntFees", "Rewards",
                       "Size", "Chunks", "Supply", "Transactions", "BlockInterval", "GasPrice"]
+stats = ["count", "mean", "max", "min", "sum", "variance", "q1", "q3"]
+
+# number of timestamp windows a cold snapshot fetch is split into
+snapshot_shards = {"daily": 2, "hourly": 8}
+
+# per deployment request scheduling: token bucket rate (requests / second) and burst,
+# the max number of requests in flight at once, and how many of those slots are kept
+# free for interactive lookups (block / author explorers)
+default_rate_limit = {
+    "rate": 10,
+    "burst": 20,
+    "max_in_flight": 4,
+    "reserved_interactive": 1,
+}
+rate_limits = {
+    "Ethereum": {"max_in_flight": 8},
+}
+
+# retries of rate limited, failed or errored requests, with jittered exponential backoff
+max_retries = 5
+retry_backoff_base = 0.5
+retry_backoff_max = 30
+
+# background refresh: networks fetched at once, and threads writing their files
+snapshot_refresh_workers = 4
+snapshot_refresh_writers = 2
+
+# standalone refresher (python refresher.py): seconds between syncs per frequency, random delay
+# added to each run, and whether it owns ingestion so the dashboard hides its refresh button
+refresh_interval = {"hourly": 60 * 60, "daily": 24 * 60 * 60}
+refresh_jitter = 5 * 60
+external_refresher = False
+
+# number of block heights fetched at once for the nakamoto coefficients, and stored per chunk
+author_heights_concurrency = 8
+author_heights_chunk = 64
+
+# realized nakamoto thresholds computed together, the first is the headline one
+nakamoto_thresholds = [0.33, 0.5, 0.66]
+
+# fast realized nakamoto: first page of largest authors, and the deepest it pages before
+# falling back to fetching every author (the hosted service caps `skip` at 5000)
+nakamoto_topk_page_size = 100
+nakamoto_topk_max_authors = 5000
+
+# graphql alias batching: initial and max lookups per request, and the response size
+# (rows across all aliases) the batch size adapts towards
+batch_size = 10
+batch_max_size = 100
+batch_target_rows = 5000
+
+# pooled http client shared by every session of the app
+client_connection_limit = 100
+client_connection_limit_per_host = 20
+client_keepalive_timeout = 60
+client_dns_cache_ttl = 300
+client_request_timeout = 60
+
+# memory budget of the in-process cache of normalized snapshot frames
+snapshot_cache_max_bytes = 512 * 1024 * 1024
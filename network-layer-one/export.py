@@ -0,0 +1,176 @@
+import os
+import sys
+import bz2
+import gzip
+import lzma
+import time
+import tarfile
+import logging
+import argparse
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import config
+import client
+import fetchers
+import store
+
+
+# Headless bulk export
+#
+#   python export.py --out exports                                 # every network, daily and hourly, parquet
+#   python export.py --network Ethereum --frequency daily --format csv --compression gzip
+#   python export.py --from 2022-01-01 --to 2022-12-31 --archive   # exports.tar.gz
+#
+# the parts of the range missing from the store are fetched first (--refresh updates every one), then each file
+# is read back in record batches and run through the dashboard's normalization, so memory is bounded
+# by --batch-size rows per worker rather than by a network's history
+
+CSV_OPENERS = {"gzip": (gzip.open, ".gz"), "bz2": (bz2.open, ".bz2"), "xz": (lzma.open, ".xz")}
+
+
+def export_path(out_dir, network, frequency, file_format, compression):
+    extension = file_format
+    if file_format == "csv" and compression in CSV_OPENERS:
+        extension += CSV_OPENERS[compression][1]
+
+    return os.path.join(out_dir, frequency, f"{network}.{extension}")
+
+
+def normalized_batches(network, frequency, from_unix, to_unix, batch_size):
+    # the latest snapshot is still open, get_snapshots leaves it out and so does the export
+    latest = store.read_snapshots(network, frequency, columns=["timestamp"])["timestamp"].max()
+    if pd.isna(latest):
+        return
+
+    condition = ds.field("timestamp") < int(latest)
+    if from_unix is not None:
+        condition &= ds.field("timestamp") >= from_unix
+    if to_unix is not None:
+        condition &= ds.field("timestamp") <= to_unix
+
+    # files are sorted by timestamp, so batches come out in order
+    dataset = ds.dataset(store.snapshot_path(network, frequency), format="parquet")
+    for batch in dataset.to_batches(filter=condition, batch_size=batch_size):
+        if batch.num_rows:
+            yield fetchers.normalize_snapshots(batch.to_pandas(), network, frequency)
+
+
+def write_parquet(file_path, batches, compression):
+    writer = None
+    try:
+        for df in batches:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(file_path, table.schema, compression=compression)
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        pd.DataFrame().to_parquet(file_path, index=False)
+
+
+def write_csv(file_path, batches, compression):
+    opener = CSV_OPENERS[compression][0] if compression in CSV_OPENERS else open
+    with opener(file_path, "wt", newline="") as outfile:
+        for i, df in enumerate(batches):
+            df.to_csv(outfile, header=i == 0, index=False)
+
+
+def export(network, frequency, args):
+    start_time = time.time()
+
+    if args.refresh:
+        client.run(fetchers.update_snapshots(network, frequency))
+    else:
+        client.run(fetchers.update_snapshot_window(
+            network, frequency, args.from_unix or 0, args.to_unix if args.to_unix is not None else int(time.time())))
+
+    file_path = export_path(args.out, network, frequency, args.format, args.compression)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    batches = normalized_batches(network, frequency, args.from_unix, args.to_unix, args.batch_size)
+    if args.format == "parquet":
+        write = lambda tmp_path: write_parquet(tmp_path, batches, args.compression)
+    else:
+        write = lambda tmp_path: write_csv(tmp_path, batches, args.compression)
+    store.atomic_write(file_path, write)
+
+    logging.info(f">> exported {network} {frequency} to {file_path} in {time.time() - start_time:.1f} seconds")
+
+    return file_path
+
+
+def archive(out_dir):
+    # tarfile streams each file in, nothing is held in memory
+    archive_path = f"{out_dir.rstrip(os.sep)}.tar.gz"
+    with tarfile.open(archive_path, "w:gz") as tar:
+        tar.add(out_dir, arcname=os.path.basename(out_dir.rstrip(os.sep)))
+
+    return archive_path
+
+
+def run(args):
+    jobs = [(network, frequency) for network in args.network for frequency in args.frequency]
+    failed = []
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(export, network, frequency, args): (network, frequency) for network, frequency in jobs}
+        for future in as_completed(futures):
+            network, frequency = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f">> {network} {frequency} export failed, {e}")
+                failed.append(f"{frequency}/{network}")
+
+    if args.archive:
+        logging.info(f">> archived exports to {archive(args.out)}")
+
+    return failed
+
+
+def to_unix(value):
+    return int(datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp()) if value else None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+
+    parser = argparse.ArgumentParser(description="Export normalized network snapshots")
+    parser.add_argument("--network", choices=list(config.deployments.keys()), action="append",
+                        help="networks to export, all of them by default")
+    parser.add_argument("--frequency", choices=store.FREQUENCIES, action="append",
+                        help="frequencies to export, all of them by default")
+    parser.add_argument("--format", choices=["parquet", "csv"], default="parquet")
+    parser.add_argument("--compression", choices=["none", "snappy", "zstd", "gzip", "bz2", "xz"], default=None,
+                        help="parquet: snappy (default), zstd, gzip or none; csv: gzip, bz2, xz or none (default)")
+    parser.add_argument("--from", dest="from_date", help="first day to export, YYYY-MM-DD (UTC)")
+    parser.add_argument("--to", dest="to_date", help="last day to export, YYYY-MM-DD (UTC)")
+    parser.add_argument("--out", default="exports", help="output directory")
+    parser.add_argument("--archive", action="store_true", help="also pack the output directory into a .tar.gz")
+    parser.add_argument("--refresh", action="store_true", help="update stored snapshots before exporting")
+    parser.add_argument("--workers", type=int, default=config.snapshot_refresh_workers)
+    parser.add_argument("--batch-size", type=int, default=10000, help="rows normalized and written at a time")
+    args = parser.parse_args()
+
+    args.network = args.network or list(config.deployments.keys())
+    args.frequency = args.frequency or store.FREQUENCIES
+    args.from_unix = to_unix(args.from_date)
+    args.to_unix = to_unix(args.to_date) + 24 * 60 * 60 - 1 if args.to_date else None
+
+    if args.format == "parquet":
+        args.compression = {None: "snappy", "none": "none"}.get(args.compression, args.compression)
+        if args.compression not in ("snappy", "zstd", "gzip", "none"):
+            parser.error(f"--compression {args.compression} is not supported for parquet")
+    elif args.compression not in (None, "none", *CSV_OPENERS):
+        parser.error(f"--compression {args.compression} is not supported for csv")
+
+    sys.exit(1 if run(args) else 0)
@@ -1,41 +1,53 @@
-import os
+import copy
+import math
 import time
 import asyncio
+import collections
 import logging
 import pandas as pd
 import streamlit as st
 from threading import Thread
-from datetime import datetime
-from aiohttp import ClientSession
-from subgrounds.subgrounds import Subgrounds
+from concurrent.futures import ThreadPoolExecutor
 from streamlit.runtime.scriptrunner.script_run_context import add_script_run_ctx
 
+import cache
 import config
+import client
 import helpers
+import scheduler
+import store
+from nakaflow.batching import BatchSizer, build_batch_query
+from nakaflow.nakamoto import nakamoto_column, period_deltas, period_stats, settle_nakamoto
 
 
-async def loop_query(session, network, query):
+async def query_page(session, network, query, lane=scheduler.BULK):
+    response = await scheduler.get_scheduler(network).post(session, query, lane)
+
+    return response["data"]
+
+
+async def loop_query(session, network, query, shards=1, lane=scheduler.BULK):
+    if shards > 1:
+        return await loop_query_sharded(session, network, query, shards, lane)
+
     start_time = time.time()
 
-    url = config.deployments[network]
     data = []
 
     continue_loop = True
     while continue_loop:
-        async with session.post(url, json=query) as response:
-            response = await response.json()
-            if "data" not in response:
-                logging.error(f">> no data,\n response: {response}\n query: {query}")
-                return data
+        response_data = await query_page(session, network, query, lane)
+        data.extend(response_data)
 
-            response_data = response["data"]["data"]
-            data.extend(response_data)
+        if len(response_data) != query["variables"]["first"]:
+            continue_loop = False
+        else:
+            df = pd.DataFrame(response_data)
+            query["variables"]["id"] = df["id"].max()
 
-            if len(response_data) != query["variables"]["first"]:
-                continue_loop = False
-            else:
-                df = pd.DataFrame(response_data)
-                query["variables"]["id"] = df["id"].max()
+            if lane == scheduler.BULK:
+                # let queued interactive lookups go before the next page
+                await asyncio.sleep(0)
 
     logging.info(">> query %s\n took %s seconds" %
                  (query, time.time() - start_time))
@@ -43,12 +55,99 @@ async def loop_query(session, network, query):
     return data
 
 
+async def loop_query_sharded(session, network, query, shards, lane=scheduler.BULK):
+    # expects a query windowed on timestamp by `from` / `to` variables, ordered by id
+    # (which grows with timestamp), so the windows concatenate back in order
+    start_time = time.time()
+
+    probe = copy.deepcopy(query)
+    probe["variables"]["first"] = 1
+    first_row = await query_page(session, network, probe, lane)
+    if not first_row:
+        return []
+
+    window_start = int(first_row[0]["timestamp"])
+    window_end = int(query["variables"]["to"])
+    step = max(-(-(window_end - window_start) // shards), 1)
+    bounds = list(range(window_start, window_end, step)) + [window_end]
+
+    async def loop_window(window_from, window_to):
+        window_query = copy.deepcopy(query)
+        window_query["variables"]["from"] = str(window_from)
+        window_query["variables"]["to"] = str(window_to)
+
+        return await loop_query(session, network, window_query, lane=lane)
+
+    windows = await asyncio.gather(*[
+        loop_window(window_from, window_to) for window_from, window_to in zip(bounds, bounds[1:])
+    ])
+
+    logging.info(">> sharded query over %s windows took %s seconds" %
+                 (len(windows), time.time() - start_time))
+
+    return [row for window in windows for row in window]
+
+
+async def loop_batch_query(session, network, root_fields, selection, first=1000, concurrency=1,
+                           lane=scheduler.BULK):
+    # merges the lookups in root_fields (key -> root field) into aliased documents, sized adaptively;
+    # root fields that reference $cursor are paginated by id, each with its own cursor
+    start_time = time.time()
+
+    sizer = BatchSizer(config.batch_size, config.batch_max_size, config.batch_target_rows)
+    results = {key: [] for key in root_fields}
+    pending = collections.deque((key, "") for key in root_fields)
+
+    async def worker():
+        while pending:
+            batch = [pending.popleft() for _ in range(min(sizer.size, len(pending)))]
+            aliases = {f"k{i}": key for i, (key, _) in enumerate(batch)}
+
+            query = build_batch_query(
+                {alias: root_fields[key] for alias, key in aliases.items()},
+                selection,
+                {f"k{i}": cursor for i, (_, cursor) in enumerate(batch)},
+                first,
+            )
+            data = await scheduler.get_scheduler(network).post(session, query, lane)
+
+            rows = 0
+            for alias, key in aliases.items():
+                page = data[alias]
+                results[key].extend(page)
+                rows += len(page)
+
+                if "$cursor" in root_fields[key] and len(page) == first:
+                    pending.append((key, max(row["id"] for row in page)))
+
+            sizer.update(rows)
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+    logging.info(">> batch query of %s lookups took %s seconds" %
+                 (len(root_fields), time.time() - start_time))
+
+    return results
+
+
 # Quantitative Data
 
-async def get_daily_quantitative_data(session, network):
+def snapshot_shards(frequency, cursor, from_unix, to_unix, first):
+    # a cold fetch walks the whole history or window, so split it across shards, but no more
+    # than the window has pages, a gap of a few snapshots is a single unsharded query
+    if cursor != "0":
+        return 1
+    if to_unix is None:
+        return config.snapshot_shards[frequency]
+
+    pages = math.ceil((int(to_unix) - int(from_unix)) / store.PERIOD_SECONDS[frequency] / first)
+    return max(min(config.snapshot_shards[frequency], pages), 1)
+
+
+async def get_daily_quantitative_data(session, network, cursor="0", from_unix=0, to_unix=None):
     q = """
-    query($first: Int, $id: ID!) {
-        data: dailySnapshots (first: $first, orderBy: id, orderDirection: asc, where: {id_gt: $id}) {
+    query($first: Int, $id: ID!, $from: BigInt!, $to: BigInt!) {
+        data: dailySnapshots (first: $first, orderBy: id, orderDirection: asc, where: {id_gt: $id, timestamp_gte: $from, timestamp_lt: $to}) {
             id,
             blockHeight,
             dailyBlocks,
@@ -190,19 +289,22 @@ async def get_daily_quantitative_data(session, network):
         "query": q,
         "variables": {
             "first": 1000,
-            "id": "0",
+            "id": cursor,
+            "from": str(int(from_unix)),
+            "to": str(int(to_unix) if to_unix is not None else int(time.time()) + 86400),
         },
     }
 
-    data = await loop_query(session, network, query)
+    shards = snapshot_shards('daily', cursor, from_unix, to_unix, query["variables"]["first"])
+    data = await loop_query(session, network, query, shards)
 
     return (network, 'daily', data)
 
 
-async def get_hourly_quantitative_data(session, network):
+async def get_hourly_quantitative_data(session, network, cursor="0", from_unix=0, to_unix=None):
     q = """
-    query($first: Int, $id: ID!) {
-        data: hourlySnapshots (first: $first, orderBy: id, orderDirection: asc, where: {id_gt: $id}) {
+    query($first: Int, $id: ID!, $from: BigInt!, $to: BigInt!) {
+        data: hourlySnapshots (first: $first, orderBy: id, orderDirection: asc, where: {id_gt: $id, timestamp_gte: $from, timestamp_lt: $to}) {
             id,
             blockHeight,
             hourlyBlocks,
@@ -344,51 +446,123 @@ async def get_hourly_quantitative_data(session, network):
         "query": q,
         "variables": {
             "first": 1000,
-            "id": "0",
+            "id": cursor,
+            "from": str(int(from_unix)),
+            "to": str(int(to_unix) if to_unix is not None else int(time.time()) + 86400),
         },
     }
 
-    data = await loop_query(session, network, query)
+    shards = snapshot_shards('hourly', cursor, from_unix, to_unix, query["variables"]["first"])
+    data = await loop_query(session, network, query, shards)
 
     return (network, 'hourly', data)
 
 
-async def update_snapshots(network, frequency):
-    logging.info(f">> updating {network} {frequency} snapshots")
+def read_snapshot_cursor(network, frequency):
+    stored = store.read_snapshots(network, frequency)
+    if len(stored.index) < 2:
+        return pd.DataFrame(), "0"
 
-    async with ClientSession() as session:
-        if frequency == 'hourly':
-            res = await get_hourly_quantitative_data(session, network)
-        else:
-            res = await get_daily_quantitative_data(session, network)
+    # the latest stored day / hour may still have been open when it was written,
+    # so resume from the one before it and let the fetch replace it
+    return stored, stored["id"].sort_values().iloc[-2]
 
-        file_path = os.path.join(os.path.dirname(__file__), f"snapshots/{res[1]}/{res[0]}.json")
-        helpers.write_to_file(file_path, res[2])
 
-        return file_path
+def merge_snapshots(stored, fetched):
+    if stored.empty:
+        return fetched
 
+    return pd.concat([stored, fetched]).drop_duplicates(subset="id", keep="last")
 
-async def get_snapshots(network, frequency, from_unix, to_unix):
-    start_time = time.time()
 
-    file_path = os.path.join(os.path.dirname(__file__), f"snapshots/{frequency}/{network}.json")
-    if not os.path.isfile(file_path):
-        file_path = await update_snapshots(network, frequency)
+def write_fetched_snapshots(network, frequency, stored, records, ranges=None):
+    fetched = store.flatten_snapshots(records, frequency)
 
-    df = pd.json_normalize(helpers.read_from_file(file_path))
-    if len(df.index) == 0 or df.empty:
-        return df
+    return store.write_snapshots(network, frequency, merge_snapshots(stored, fetched), ranges)
 
-    df = helpers.date_filter_df(df, from_unix, to_unix)
+
+def fetch_snapshots(session, network, frequency, cursor="0", from_unix=0, to_unix=None):
+    if frequency == 'hourly':
+        return get_hourly_quantitative_data(session, network, cursor, from_unix, to_unix)
+
+    return get_daily_quantitative_data(session, network, cursor, from_unix, to_unix)
+
+
+async def update_snapshots(network, frequency, executor=None):
+    # file reads and writes go through the executor, so they don't hold up the client loop
+    with store.snapshot_lock(network, frequency) as locked:
+        if not locked:
+            logging.info(f">> {network} {frequency} snapshots are already being refreshed, skipping")
+            return None
+
+        logging.info(f">> updating {network} {frequency} snapshots")
+
+        loop = asyncio.get_running_loop()
+        stored, cursor = await loop.run_in_executor(executor, read_snapshot_cursor, network, frequency)
+
+        # when only the windows someone looked at are stored, the cursor would skip the gaps
+        # between them, so walk the whole history once
+        covered = store.snapshot_ranges(network, frequency)
+        if not (len(covered) == 1 and covered[0][0] == 0):
+            cursor = "0"
+
+        res = await fetch_snapshots(client.session(), network, frequency, cursor)
+
+        # the store cuts the range at the latest snapshot fetched
+        return await loop.run_in_executor(
+            executor, write_fetched_snapshots, network, frequency, stored, res[2], [[0, int(time.time())]])
+
+
+def plan_snapshot_window(network, frequency, from_unix, to_unix):
+    # [from, to) timestamp ranges of the window that aren't stored yet; a tail shorter than one
+    # snapshot period is left to the next refresh, so reruns don't refetch the open snapshot
+    now = int(time.time())
+    gaps = store.missing_ranges(
+        store.snapshot_ranges(network, frequency), int(from_unix), min(int(to_unix) + 1, now))
+
+    if gaps and gaps[-1][1] == now and now - gaps[-1][0] < store.PERIOD_SECONDS[frequency]:
+        gaps = gaps[:-1]
+
+    return gaps
+
+
+async def update_snapshot_window(network, frequency, from_unix, to_unix, executor=None):
+    # fetches only the parts of the window the store is missing and merges them in,
+    # so a first look at a network pulls days of snapshots instead of its whole history
+    with store.snapshot_lock(network, frequency) as locked:
+        if not locked:
+            logging.info(f">> {network} {frequency} snapshots are already being refreshed, skipping")
+            return None
+
+        gaps = plan_snapshot_window(network, frequency, from_unix, to_unix)
+        if not gaps:
+            return None
+
+        logging.info(f">> fetching {len(gaps)} missing {network} {frequency} snapshot ranges {gaps}")
+
+        session = client.session()
+        results = await asyncio.gather(*[
+            fetch_snapshots(session, network, frequency, "0", gap_from, gap_to) for gap_from, gap_to in gaps
+        ])
+
+        loop = asyncio.get_running_loop()
+        stored = await loop.run_in_executor(executor, store.read_snapshots, network, frequency)
+        ranges = store.snapshot_ranges(network, frequency) + gaps  # cut at the latest snapshot fetched
+        records = [row for res in results for row in res[2]]
+
+        return await loop.run_in_executor(
+            executor, write_fetched_snapshots, network, frequency, stored, records, ranges)
+
+
+def normalize_snapshots(df, network, frequency):
     if len(df.index) == 0 or df.empty:
         return df
 
-    df = df.sort_values(by=['timestamp'], ascending=False)
+    df = df.sort_values(by=['timestamp'])
     df = df.reset_index(drop=True)
-    df = df.iloc[1:, :]
     df = df.fillna(0)
 
-    df = df.rename({
+    renames = {
         f'{frequency}Blocks': 'blocks',
         'cumulativeUniqueAuthors': f'{frequency}UniqueAuthors_cumulative',
         'cumulativeDifficulty': f'{frequency}Difficulty_cumulative',
@@ -397,96 +571,113 @@ async def get_snapshots(network, frequency, from_unix, to_unix):
         'cumulativeRewards': f'{frequency}Rewards_cumulative',
         'cumulativeSize': f'{frequency}Size_cumulative',
         'cumulativeTransactions': f'{frequency}Transactions_cumulative',
-    }, axis='columns')
-
-    for metric in config.metrics_with_stats:
-        df[metric] = df.apply(
-            lambda x: helpers.create_stats_obj(
-                x[f'{frequency}{metric}.count'] if f'{frequency}{metric}.count' in df.columns else None,
-                x[f'{frequency}{metric}.mean'] if f'{frequency}{metric}.mean' in df.columns else None,
-                x[f'{frequency}{metric}.max'] if f'{frequency}{metric}.max' in df.columns else None,
-                x[f'{frequency}{metric}.min'] if f'{frequency}{metric}.min' in df.columns else None,
-                x[f'{frequency}{metric}.sum'] if f'{frequency}{metric}.sum' in df.columns else None,
-                x[f'{frequency}{metric}.variance'] if f'{frequency}{metric}.variance' in df.columns else None,
-                x[f'{frequency}{metric}.q1'] if f'{frequency}{metric}.q1' in df.columns else None,
-                x[f'{frequency}{metric}.q3'] if f'{frequency}{metric}.q3' in df.columns else None,
-                x[f'{frequency}{metric}_cumulative'] if f'{frequency}{metric}_cumulative' in df.columns else None,
-            ), axis=1
-        )
-
-        if f'{frequency}{metric}.count' in df.columns:
-            df = df.rename(
-                {f'{frequency}{metric}.count': f'{frequency}{metric}_count'}, axis='columns')
-            df = df.astype({f'{frequency}{metric}_count': 'int'})
-        if f'{frequency}{metric}.mean' in df.columns:
-            df = df.rename(
-                {f'{frequency}{metric}.mean': f'{frequency}{metric}_mean'}, axis='columns')
-            df = df.astype({f'{frequency}{metric}_mean': 'float'})
-        if f'{frequency}{metric}.max' in df.columns:
-            df = df.rename({f'{frequency}{metric}.max': f'{frequency}{metric}_max'}, axis='columns')
-            df = df.astype({f'{frequency}{metric}_max': 'float'})
-        if f'{frequency}{metric}.min' in df.columns:
-            df = df.rename({f'{frequency}{metric}.min': f'{frequency}{metric}_min'}, axis='columns')
-            df = df.astype({f'{frequency}{metric}_min': 'float'})
-        if f'{frequency}{metric}.sum' in df.columns:
-            df = df.rename({f'{frequency}{metric}.sum': f'{frequency}{metric}_sum'}, axis='columns')
-            df = df.astype({f'{frequency}{metric}_sum': 'float'})
-        if f'{frequency}{metric}.variance' in df.columns:
-            df = df.rename(
-                {f'{frequency}{metric}.variance': f'{frequency}{metric}_variance'}, axis='columns')
-            df = df.astype({f'{frequency}{metric}_variance': 'float'})
-        if f'{frequency}{metric}.q1' in df.columns:
-            df = df.rename({f'{frequency}{metric}.q1': f'{frequency}{metric}_q1'}, axis='columns')
-            df = df.astype({f'{frequency}{metric}_q1': 'float'})
-        if f'{frequency}{metric}.q3' in df.columns:
-            df = df.rename({f'{frequency}{metric}.q3': f'{frequency}{metric}_q3'}, axis='columns')
-            df = df.astype({f'{frequency}{metric}_q3': 'float'})
-        if f'{frequency}{metric}_cumulative' in df.columns:
-            df = df.astype({f'{frequency}{metric}_cumulative': 'float'})
-
-    df = df.astype({
+    }
+    dtypes = {
         'blockHeight': 'int',
         'blocks': 'int',
         'totalSupply': 'float',
-        'gasPrice': 'float'
-    })
+        'gasPrice': 'float',
+    }
+    for metric in config.metrics_with_stats:
+        for stat in config.stats:
+            renames[f'{frequency}{metric}.{stat}'] = f'{frequency}{metric}_{stat}'
+            dtypes[f'{frequency}{metric}_{stat}'] = 'int' if stat == 'count' else 'float'
+        dtypes[f'{frequency}{metric}_cumulative'] = 'float'
 
-    df["network"] = network
-    df["datetime"] = df["timestamp"].apply(
-        lambda x: datetime.fromtimestamp(int(x)))
+    df = df.rename(renames, axis='columns')
+    df = df.astype({col: dtype for col, dtype in dtypes.items() if col in df.columns})
+
+    columns = {
+        metric: helpers.create_stats_column(df, f'{frequency}{metric}') for metric in config.metrics_with_stats
+    }
+    columns["network"] = network
+    columns["datetime"] = pd.to_datetime(df["timestamp"], unit="s")
+
+    return pd.concat([df, pd.DataFrame(columns, index=df.index)], axis='columns')
+
+
+def load_snapshots(network, frequency):
+    # the normalized frame is cached per file version, so reruns and date range changes
+    # only slice it; a refresh rewrites the file and so invalidates the entry
+    version = store.snapshot_version(network, frequency)
+    df = cache.snapshots.get((network, frequency), version)
+    if df is None:
+        df = normalize_snapshots(store.read_snapshots(network, frequency), network, frequency)
+        if version is not None:
+            cache.snapshots.put((network, frequency), version, df)
+
+    return df
+
+
+async def get_snapshots(network, frequency, from_unix, to_unix):
+    start_time = time.time()
+
+    # reading, migrating and normalizing files runs in the default executor, so a cache miss
+    # doesn't hold up every other session's requests on the client loop
+    loop = asyncio.get_running_loop()
+
+    if await loop.run_in_executor(None, plan_snapshot_window, network, frequency, from_unix, to_unix):
+        try:
+            await update_snapshot_window(network, frequency, from_unix, to_unix)
+        except scheduler.QueryError as e:
+            logging.error(f">> {e}")
+            if not store.has_snapshots(network, frequency):
+                return pd.DataFrame()
+
+    df = await loop.run_in_executor(None, load_snapshots, network, frequency)
+    if len(df.index) == 0 or df.empty:
+        return df
+
+    df = helpers.date_filter_df(df, from_unix, to_unix)
+    df = df.iloc[-2::-1]  # latest first, without the latest (still open) snapshot
 
     logging.info(">> %s %s quantitative data took %s seconds" % (network, frequency, time.time() - start_time))
 
     return df
 
 
-async def update_snapshots_all_networks():
+async def update_snapshots_all_networks(frequencies=store.FREQUENCIES):
+    # returns how each `{frequency}/{network}` went: updated, skipped (refreshed elsewhere) or the error
     start_time = time.time()
 
-    logging.info(">> updating all network daily and hourly snapshots in background")
-    st.session_state['are_snapshots_updated'] = 0
+    logging.info(f">> updating all network {' and '.join(frequencies)} snapshots in background")
 
-    async with ClientSession() as session:
-        networks = config.deployments.keys()
-        tasks = []
-        for network in networks:
-            tasks.append(asyncio.ensure_future(get_daily_quantitative_data(session, network)))
-            tasks.append(asyncio.ensure_future(get_hourly_quantitative_data(session, network)))
+    # a few workers take the next network as soon as their last one is written, so one slow
+    # deployment doesn't hold up the rest and only in-flight networks are held in memory
+    jobs = asyncio.Queue()
+    for network in config.deployments.keys():
+        for frequency in frequencies:
+            jobs.put_nowait((network, frequency))
 
-        res = await asyncio.gather(*tasks)
-        for r in res:
-            file_path = os.path.join(os.path.dirname(__file__), f"snapshots/{r[1]}/{r[0]}.json")
-            helpers.write_to_file(file_path, r[2])
+    results = {}
 
-        st.session_state['are_snapshots_updated'] = 1
+    async def worker(executor):
+        while not jobs.empty():
+            network, frequency = jobs.get_nowait()
+            try:
+                written = await update_snapshots(network, frequency, executor)
+                results[f"{frequency}/{network}"] = "updated" if written else "skipped"
+            except Exception as e:
+                logging.error(f">> skipping {network} {frequency} snapshot refresh, {e}")
+                results[f"{frequency}/{network}"] = str(e)
 
-        logging.info(">> refreshing all network quantitative data took %s seconds" % (time.time() - start_time))
+    with ThreadPoolExecutor(max_workers=config.snapshot_refresh_writers) as executor:
+        await asyncio.gather(*[worker(executor) for _ in range(config.snapshot_refresh_workers)])
 
-        return
+    logging.info(">> refreshing all network quantitative data took %s seconds" % (time.time() - start_time))
+
+    return results
 
 
 def refresh_snapshots():
-    thread = Thread(target=asyncio.run, args=(update_snapshots_all_networks(),), daemon=True)
+    # the refresh itself runs on the client loop, this thread only waits on it
+    # so session_state is updated from a thread that carries the script context
+    def refresh():
+        st.session_state['are_snapshots_updated'] = 0
+        client.run(update_snapshots_all_networks())
+        st.session_state['are_snapshots_updated'] = 1
+
+    thread = Thread(target=refresh, daemon=True)
     add_script_run_ctx(thread)
     thread.start()
 
@@ -495,44 +686,42 @@ def refresh_snapshots():
 
 # Block Data
 
-async def get_block_data(session, network, block_id):
-    q = """
-    query($first: Int, $id: ID!) {
-        data: blocks (first: $first, orderBy: id, orderDirection: desc, where: {id: $id}) {
-            id,
-            hash,
-            timestamp,
-            author {
-                id
-                cumulativeDifficulty
-                cumulativeBlocksCreated
-            },
-            size,
-            baseFeePerGas,
-            difficulty,
-            gasLimit,
-            gasUsed,
-            blockUtilization,
-            gasPrice,
-            burntFees,
-            chunkCount,
-            transactionCount,
-            rewards,
-        }
+async def get_blocks_data(session, network, block_ids, lane=scheduler.BULK):
+    selection = """
+    {
+        id,
+        hash,
+        timestamp,
+        author {
+            id
+            cumulativeDifficulty
+            cumulativeBlocksCreated
+        },
+        size,
+        baseFeePerGas,
+        difficulty,
+        gasLimit,
+        gasUsed,
+        blockUtilization,
+        gasPrice,
+        burntFees,
+        chunkCount,
+        transactionCount,
+        rewards,
     }
     """
 
-    query = {
-        "query": q,
-        "variables": {
-            "first": 1000,
-            "id": int(block_id),
-        },
+    root_fields = {
+        block_id: f'blocks(where: {{id: "{int(block_id)}"}})' for block_id in block_ids
     }
 
-    data = await loop_query(session, network, query)
+    return await loop_batch_query(session, network, root_fields, selection, lane=lane)
 
-    return data
+
+async def get_block_data(session, network, block_id, lane=scheduler.BULK):
+    data = await get_blocks_data(session, network, [block_id], lane)
+
+    return data[block_id]
 
 
 async def get_block_snapshot(network, block_id):
@@ -540,19 +729,23 @@ async def get_block_snapshot(network, block_id):
 
     df = pd.DataFrame()
 
-    async with ClientSession() as session:
-        data = await get_block_data(session, network, block_id)
-        df = pd.json_normalize(data)
+    try:
+        data = await get_block_data(client.session(), network, block_id, scheduler.INTERACTIVE)
+    except scheduler.QueryError as e:
+        logging.error(f">> {e}")
+        return df
+
+    df = pd.json_normalize(data)
 
-        logging.info(">> block data took %s seconds for block_id: %s" %
-                     (time.time() - start_time, block_id))
+    logging.info(">> block data took %s seconds for block_id: %s" %
+                 (time.time() - start_time, block_id))
 
-        return df
+    return df
 
 
 # Author Data
 
-async def get_author_data(session, network, author_id):
+async def get_author_data(session, network, author_id, lane=scheduler.BULK):
     q = """
     query($first: Int, $author_id: String!) {
         data: authors(first: $first, orderBy: id, orderDirection: asc, where: {id: $author_id}) {
@@ -571,7 +764,7 @@ async def get_author_data(session, network, author_id):
         },
     }
 
-    data = await loop_query(session, network, query)
+    data = await loop_query(session, network, query, lane=lane)
 
     return data
 
@@ -581,14 +774,18 @@ async def get_author_snapshot(network, author_id):
 
     df = pd.DataFrame()
 
-    async with ClientSession() as session:
-        data = await get_author_data(session, network, author_id)
-        df = pd.json_normalize(data)
+    try:
+        data = await get_author_data(client.session(), network, author_id, scheduler.INTERACTIVE)
+    except scheduler.QueryError as e:
+        logging.error(f">> {e}")
+        return df
 
-        logging.info(">> author data took %s seconds for author_id: %s" %
-                     (time.time() - start_time, author_id))
+    df = pd.json_normalize(data)
 
-        return df
+    logging.info(">> author data took %s seconds for author_id: %s" %
+                 (time.time() - start_time, author_id))
+
+    return df
 
 
 # async def get_author_snapshots(network, blocks):
@@ -629,33 +826,32 @@ async def get_author_snapshot(network, author_id):
 
 # Nakamoto Coefficient Data
 
-sg = Subgrounds()
+async def get_authors_at_heights(session, network, heights):
+    selection = """
+    {
+        id
+        cumulativeDifficulty
+        cumulativeBlocksCreated
+    }
+    """
 
+    root_fields = {
+        height: ("authors(first: $first, orderBy: id, orderDirection: asc, where: {id_gt: $cursor}, "
+                 f"block: {{number: {int(height)}}})")
+        for height in heights
+    }
+
+    return await loop_batch_query(session, network, root_fields, selection,
+                                  concurrency=config.author_heights_concurrency)
 
-@st.cache(allow_output_mutation=True)
-def author_data(network, deployment, blocks):
-    df = pd.DataFrame()
-    for block in blocks:
-        subgraph = sg.load_subgraph(deployment)
-        records = subgraph.Query.authors(
-            orderBy=subgraph.Author.cumulativeBlocksCreated,
-            orderDirection='desc',
-            block={'number': block},
-            first=5000
-        )
-
-        authors = sg.query_df([
-            records.id,
-            records.cumulativeDifficulty,
-            records.cumulativeBlocksCreated,
-        ])
-        authors = authors.rename(columns=lambda x: x[len("authors_"):])
 
-        authors["height"] = block
+async def get_author_history(network, blocks):
+    start_time = time.time()
 
-        df = pd.concat([df, authors]).reset_index(drop=True)
+    authors = await get_authors_at_heights(client.session(), network, blocks)
+    records = [{**author, "height": height} for height in blocks for author in authors[height]]
 
-    df["network"] = network
+    df = pd.DataFrame.from_records(records, columns=store.AUTHOR_COLUMNS)
 
     df = df.fillna(0)
     df = df.astype({
@@ -663,4 +859,182 @@ def author_data(network, deployment, blocks):
         'cumulativeBlocksCreated': 'float'
     })
 
+    logging.info(">> %s author history took %s seconds for %s heights" %
+                 (network, time.time() - start_time, len(blocks)))
+
+    return df
+
+
+def sync_author_history(network, blocks, progress=None):
+    # authors at a past height never change, so only heights missing from the store are fetched.
+    # each chunk is fetched concurrently and stored before the next, so progress is reported
+    # as it goes and an interrupted run picks up where it stopped
+    stored = store.read_author_history(network, blocks, columns=["height"])
+    missing = sorted(set(blocks) - set(stored["height"]))
+
+    for i in range(0, len(missing), config.author_heights_chunk):
+        chunk = missing[i:i + config.author_heights_chunk]
+        store.append_author_history(network, client.run(get_author_history(network, chunk)))
+
+        if progress:
+            progress(i + len(chunk), len(missing))
+
+    return len(missing)
+
+
+@st.cache(allow_output_mutation=True)
+def author_data(network, blocks):
+    sync_author_history(network, blocks)
+
+    df = store.read_author_history(network, blocks).reset_index(drop=True)
+    df["network"] = network
+
+    return df
+
+
+def author_period_stats(network, blocks, thresholds=config.nakamoto_thresholds, progress=None):
+    # stats of each period between consecutive heights in blocks, computed periods are stored
+    # and only the missing ones, or ones stored without every threshold, are computed.
+    # nakamoto_realized is the first of the thresholds
+    thresholds = [thresholds] if isinstance(thresholds, (int, float)) else list(thresholds)
+    columns = [nakamoto_column(threshold) for threshold in thresholds]
+    periods = list(zip(blocks, blocks[1:]))
+    if not periods:
+        # fewer than two heights make no period
+        return pd.DataFrame(columns=[
+            "from_height", "height", "author_count", "nakamoto_realized", *columns,
+            "sum", "mean", "median", "max", "min", "std", "q3", "q1", "gini", "hhi", "network",
+        ])
+
+    df = store.read_author_stats(network)
+    if all(col in df.columns for col in columns + ["gini", "hhi"]):
+        df = df.dropna(subset=columns)
+    else:
+        df = df.iloc[:0]
+
+    missing = sorted(set(periods) - set(zip(df["from_height"], df["height"])))
+    if missing:
+        # blocks created per period stay in long (period, author) rows, so memory follows the
+        # authors actually present rather than every author ever seen times every period
+        heights = sorted(set(height for period in missing for height in period))
+        sync_author_history(network, heights, progress)
+
+        authors = author_data(network, heights)
+        deltas = period_deltas(authors, missing)
+
+        # every threshold comes out of the same pass, the store keeps them by threshold
+        stats = period_stats(deltas, missing, thresholds).reset_index().drop(columns="nakamoto_realized")
+
+        store.append_author_stats(network, stats)
+        df = pd.concat([df, stats]) if not df.empty else stats
+
+    df = df.set_index(["from_height", "height"]).loc[periods].reset_index()
+    df["nakamoto_realized"] = df[columns[0]]
+    df["network"] = network
+
+    return df
+
+
+async def get_top_authors(session, network, height, first, skip):
+    query = {
+        "query": """
+        query($height: Int!, $first: Int!, $skip: Int!) {
+            data: authors(first: $first, skip: $skip, orderBy: cumulativeBlocksCreated,
+                          orderDirection: desc, block: {number: $height}) {
+                id
+                cumulativeBlocksCreated
+            }
+        }
+        """,
+        "variables": {"height": int(height), "first": first, "skip": skip}
+    }
+
+    return await query_page(session, network, query)
+
+
+async def get_authors_by_id(session, network, height, author_ids):
+    query = {
+        "query": """
+        query($height: Int!, $first: Int!, $ids: [ID!]) {
+            data: authors(first: $first, where: {id_in: $ids}, block: {number: $height}) {
+                id
+                cumulativeBlocksCreated
+            }
+        }
+        """,
+        "variables": {"height": int(height), "first": len(author_ids), "ids": author_ids}
+    }
+
+    return await query_page(session, network, query) if author_ids else []
+
+
+async def get_period_nakamoto(session, network, from_height, height, threshold=0.33):
+    # pages the largest authors at `height` until the unseen ones can no longer move the
+    # realized nakamoto coefficient: each unseen author created at most as many blocks as the
+    # last one seen, and the period holds at most height - from_height blocks.
+    # None when it is still open at the paging limit
+    authored = {}
+    first = config.nakamoto_topk_page_size
+    skip = 0
+
+    while skip < config.nakamoto_topk_max_authors:
+        first = min(first, config.nakamoto_topk_max_authors - skip)
+        page = await get_top_authors(session, network, height, first, skip)
+        previous = await get_authors_by_id(session, network, from_height, [author["id"] for author in page])
+
+        # like the full computation, authors missing at the start of the period are left out
+        created = {author["id"]: float(author["cumulativeBlocksCreated"]) for author in previous}
+        for author in page:
+            if author["id"] in created:
+                authored[author["id"]] = float(author["cumulativeBlocksCreated"]) - created[author["id"]]
+
+        skip += len(page)
+        if len(page) < first:
+            return settle_nakamoto(list(authored.values()), 0, 0, threshold)
+
+        if sum(authored.values()) > height - from_height:
+            # more blocks than the period holds, the total bound doesn't apply to this subgraph
+            return None
+
+        bound = float(page[-1]["cumulativeBlocksCreated"])
+        realized = settle_nakamoto(list(authored.values()), bound, height - from_height, threshold)
+        if realized is not None:
+            logging.info(">> %s nakamoto settled after %s authors at height %s" % (network, skip, height))
+            return realized
+
+        first = min(first * 2, 1000)
+
+    return None
+
+
+def author_period_nakamoto(network, blocks, threshold=0.33):
+    # realized nakamoto only, from the largest authors of each period; periods already in the
+    # store or left open by the bound go through author_period_stats
+    periods = list(zip(blocks, blocks[1:]))
+
+    column = nakamoto_column(threshold)
+    stored = store.read_author_stats(network)
+    if column in stored.columns:
+        stored = stored.dropna(subset=[column]).set_index(["from_height", "height"])[column].to_dict()
+    else:
+        stored = {}
+    missing = [period for period in periods if period not in stored]
+
+    async def settle_all():
+        session = client.session()
+        return await asyncio.gather(*[
+            get_period_nakamoto(session, network, from_height, height, threshold) for from_height, height in missing
+        ])
+
+    realized = {**stored, **dict(zip(missing, client.run(settle_all()) if missing else []))}
+
+    for from_height, height in [period for period in periods if realized[period] is None]:
+        logging.info(">> %s nakamoto open at height %s, fetching every author" % (network, height))
+        full = author_period_stats(network, [from_height, height], threshold)
+        realized[(from_height, height)] = full["nakamoto_realized"].iloc[0]
+
+    df = pd.DataFrame(periods, columns=["from_height", "height"])
+    df["nakamoto_realized"] = [int(realized[period]) for period in periods]
+    df["network"] = network
+
     return df
@@ -1,6 +1,6 @@
 from cProfile import label
 import time
-import json
+import pandas as pd
 import streamlit as st
 from st_aggrid import AgGrid, JsCode
 
@@ -70,40 +70,28 @@ def df_to_csv(df):
     return df.to_csv().encode('utf-8')
 
 
-def read_from_file(file_path):
-    with open(file_path, 'r') as openfile:
-        data = json.load(openfile)
-
-    return data
-
-
-def write_to_file(file_path, data):
-    with open(file_path, "w") as outfile:
-        outfile.write(json.dumps(data))
-
-    return file_path
-
-
 def date_filter_df(df, start, end, col_name="timestamp"):
-    filtered_df = df[df[col_name] >= str(start)]
-    filtered_df = filtered_df[filtered_df[col_name] <= str(end)]
-    filtered_df = filtered_df.reset_index()
-
-    return filtered_df
-
-
-def create_stats_obj(count, mean, max, min, sum, variance, upper_quartile, lower_quartile, cumulative=None):
-    return json.dumps({
-        "count": count,
-        "mean": mean,
-        "max": max,
-        "min": min,
-        "sum": sum,
-        "variance": variance,
-        "upper_quartile": upper_quartile,
-        "lower_quartile": lower_quartile,
-        "cumulative": cumulative
-    })
+    # df must be sorted ascending on the integer col_name, returns a slice of it
+    values = df[col_name].to_numpy()
+
+    return df.iloc[values.searchsorted(int(start), side="left"):values.searchsorted(int(end), side="right")]
+
+
+def create_stats_column(df, prefix):
+    # one JSON object per row for the AgGrid cell renderer, serialized column-wise
+    stats = pd.DataFrame({
+        "count": df.get(f'{prefix}_count'),
+        "mean": df.get(f'{prefix}_mean'),
+        "max": df.get(f'{prefix}_max'),
+        "min": df.get(f'{prefix}_min'),
+        "sum": df.get(f'{prefix}_sum'),
+        "variance": df.get(f'{prefix}_variance'),
+        "upper_quartile": df.get(f'{prefix}_q3'),
+        "lower_quartile": df.get(f'{prefix}_q1'),
+        "cumulative": df.get(f'{prefix}_cumulative'),
+    }, index=df.index)
+
+    return pd.Series(stats.to_json(orient="records", lines=True, double_precision=15).splitlines(), index=df.index)
 
 
 def data_grid(df, grid_height=300):
@@ -11,6 +11,7 @@ from helpers import (
     get_network_subgraphs,
     date_filter_df,
 )
+from nakamoto import GRANULARITIES
 from charting import (
     plotly_box_plot,
     plotly_lines,
@@ -36,6 +37,9 @@ with st.sidebar:
     network = st.selectbox('Network', networks)
     url = network_subgraphs[network_subgraphs['name']==network].get('url').iloc[0]
     messari_asset_slug = network_subgraphs[network_subgraphs['name']==network].get('slug').iloc[0]
+    # per network headline threshold, 0 means none set
+    nakamoto_ratio = network_subgraphs[network_subgraphs['name']==network].get('nakamoto.ratio').iloc[0] or 0.33
+    nakamoto_thresholds = [nakamoto_ratio] + [t for t in (0.33, 0.5, 0.66) if t != nakamoto_ratio]
 
     #***** Filters *****
     st.write('Filters')
@@ -43,9 +47,15 @@ with st.sidebar:
     start_date = col1.date_input('start date', datetime.date(2021,1,1))
     end_date = col2.date_input('end date', datetime.datetime.now().date())
 
+    col1, col2 = st.columns(2)
+    granularity = col1.selectbox('nakamoto period', GRANULARITIES)
+    every_n_blocks = col2.number_input(
+        'every N blocks', min_value=1, value=100000, step=10000, disabled=granularity != 'blocks'
+    )
+
 # Handling nework storage
 if network not in st.session_state:
-    nw = Network(url)
+    nw = Network(url, nakamoto=nakamoto_thresholds, store_dir=os.path.join(os.path.dirname(__file__), 'store'))
     st.session_state[network] = nw
 else:
     nw = st.session_state[network]
@@ -100,16 +110,24 @@ col3.image(image, caption='Winners care about decentralization')
 
 
 st.write('### Nakamoto Analysis')
+if (nw.granularity, nw.every_n_blocks) != (granularity, every_n_blocks):
+    nw.granularity, nw.every_n_blocks = granularity, every_n_blocks
+    nw.author_snapshots, nw.author_stats = pd.DataFrame(), pd.DataFrame()
+
 if nw.author_stats.empty:
     with st.spinner(f'Getting {network} author stats, be patient. The longer this takes the more decentralized the project (typically).'):
-        asyncio.run(nw.get_author_stats())
+        progress_bar = st.progress(0)
+        asyncio.run(nw.get_author_stats(
+            progress=lambda done, total: progress_bar.progress(done / total, text=f'{done} of {total} heights')
+        ))
+        progress_bar.empty()
         st.session_state[network] = nw
 
 col1, col2, col3 = st.columns(3)
 author_stats = date_filter_df(nw.author_stats, start_date, end_date)
 col1.dataframe(author_stats)
 
-real_nak_fig = plotly_lines(author_stats.set_index('date')[['nakamoto.realized']])
+real_nak_fig = plotly_lines(author_stats.set_index('date')[[f'nakamoto.realized.{round(t * 100)}' for t in nakamoto_thresholds]])
 real_nak_fig = clean_plotly_fig(real_nak_fig)
 real_nak_fig.update_layout(
     title='<b>Realized Nakamoto Coefficient</b>',
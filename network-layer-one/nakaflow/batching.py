@@ -0,0 +1,59 @@
+"""
+GraphQL alias batching,
+many lookups of the same shape merged into one document and split back per key
+"""
+from typing import Dict, Optional
+
+
+class BatchSizer:
+    """
+    Adaptive number of aliases per document,
+    halves when responses come back larger than the target and doubles when well under it
+    """
+
+    def __init__(self, size: int = 10, max_size: int = 100, target_rows: int = 5000):
+        self.size = size
+        self.max_size = max_size
+        self.target_rows = target_rows
+
+    def update(self, rows: int) -> int:
+        if rows > self.target_rows:
+            self.size = max(self.size // 2, 1)
+        elif rows < self.target_rows // 2:
+            self.size = min(self.size * 2, self.max_size)
+        return self.size
+
+
+def build_batch_query(
+    root_fields: Dict[str, str],
+    selection: str,
+    cursors: Optional[Dict[str, str]] = None,
+    first: int = 1000,
+) -> Dict:
+    """
+    One query document with an aliased root field per key.
+    Root fields may reference `$first` and `$cursor`,
+    `$cursor` is bound to the alias' own entry in cursors
+    """
+    cursors = cursors or {}
+    definitions = []
+    variables = {}
+    fields = []
+
+    if any("$first" in root_field for root_field in root_fields.values()):
+        definitions.append("$first: Int")
+        variables["first"] = first
+
+    for alias, root_field in root_fields.items():
+        if "$cursor" in root_field:
+            definitions.append(f"$cursor_{alias}: ID!")
+            variables[f"cursor_{alias}"] = cursors.get(alias, "")
+            root_field = root_field.replace("$cursor", f"$cursor_{alias}")
+
+        fields.append(f"{alias}: {root_field} {selection}")
+
+    header = f"query({', '.join(definitions)})" if definitions else "query"
+    return {
+        "query": f"{header} {{ {' '.join(fields)} }}",
+        "variables": variables,
+    }
@@ -42,7 +42,8 @@ def get_network_subgraphs() -> pd.DataFrame:
 def date_filter_df(
     df: pd.DataFrame, start, end, col_name: str = "date"
 ) -> pd.DataFrame:
-    """Helper for dt filtering by date column"""
-    tmp_df = df[df[col_name] >= start]
-    tmp_df = tmp_df[tmp_df[col_name] <= end]
-    return tmp_df
+    """Helper for dt filtering by date column, df must be sorted by it"""
+    values = df[col_name].to_numpy()
+    return df.iloc[
+        values.searchsorted(start, side="left") : values.searchsorted(end, side="right")
+    ]
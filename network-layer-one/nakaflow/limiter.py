@@ -0,0 +1,61 @@
+"""
+Adaptive request concurrency,
+additive increase while responses stay healthy and multiplicative decrease when they don't
+"""
+import asyncio
+from typing import Optional
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limit on in-flight requests.
+    Every `limit` healthy responses in a row raise it by one,
+    a throttled or failed request, or one much slower than the recent average, halves it.
+    The average is an EWMA of response latencies, so it follows batches growing or
+    shrinking instead of holding on to the fastest response ever seen
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 32,
+        latency_factor: float = 3.0,
+        smoothing: float = 0.2,
+    ):
+        self.limit = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_factor = latency_factor
+        self.smoothing = smoothing
+
+        self.in_flight = 0
+        self.healthy = 0  # healthy responses since the last change
+        self.baseline: Optional[float] = None  # EWMA of response latencies
+        self.condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self, latency: Optional[float] = None):
+        """Latency of a healthy response, None for throttled or failed requests"""
+        async with self.condition:
+            self.in_flight -= 1
+
+            slow = latency is not None and self.baseline is not None and latency > self.latency_factor * self.baseline
+            if latency is not None:
+                self.baseline = latency if self.baseline is None else (
+                    self.baseline + self.smoothing * (latency - self.baseline))
+
+            if latency is None or slow:
+                self.limit = max(self.limit // 2, self.min_limit)
+                self.healthy = 0
+            else:
+                self.healthy += 1
+                if self.healthy >= self.limit:
+                    self.limit = min(self.limit + 1, self.max_limit)
+                    self.healthy = 0
+
+            self.condition.notify_all()
@@ -1,6 +1,6 @@
 # Networking
 from aiohttp import ClientSession
-import requests
+import asyncio
 
 # Datasci
 import pandas as pd
@@ -8,9 +8,11 @@ import pandas as pd
 # Plotting
 # other
 import datetime
+import os
+import re
 import time
 
-from typing import Dict
+from typing import AsyncIterator, Dict, List, Optional
 
 
 class Subgraph:
@@ -26,86 +28,181 @@ class Subgraph:
         # Snapshots
         self.usage_snapshots = pd.DataFrame()
 
-    # NOTE: this should be a general function
-    # TODO: figure out async
-    def get_users_raw(self, first: int = 1000, refresh: bool = False) -> pd.DataFrame:
-        # Checking for cache
-        if not self.users_raw.empty and not refresh:
-            return self.users_raw
+    async def post(self, session, query: Dict) -> Dict:
+        """Response data of a query, raises when the subgraph returns none"""
+        async with session.post(self.url, json=query) as response:
+            response = await response.json(content_type=None)
 
+        if "data" not in response or "errors" in response:
+            raise RuntimeError(f"no data from {self.url}: {response.get('errors', response)}")
+        return response["data"]
+
+    async def iter_users(
+        self, session, first: int = 1000, shards: int = 1
+    ) -> AsyncIterator[List[str]]:
+        """
+        Account ids in batches of up to `first`, yielded as pages arrive.
+        shards > 1 splits the id space into ranges paged concurrently,
+        batches are then in id order within a range but not across ranges
+        """
         q = """
-        query($first: Int, $id: ID!) {
-          accounts(first: $first, orderBy: id, orderDirection: asc, where: {id_gt: $id}) {
+        query($first: Int, $id: ID!%s) {
+          accounts(first: $first, orderBy: id, orderDirection: asc, where: {id_gt: $id%s}) {
             id
           }
         }
         """
 
-        # Starting Variables
-        addr = "0x0000000000000000000000000000000000000000"
-
-        query = {
-            "query": q,
-            "variables": {
-                "first": first,
-                "id": addr,
-            },
-        }
-        response = requests.post(self.url, json=query).json()
-        df = pd.DataFrame(response["data"]["accounts"])
-
-        while len(response["data"]["accounts"]) == first:
-            addr = df["id"].max()
-            print(addr)
-
-            query["variables"]["id"] = addr  # iterate to next address
-            response = requests.post(self.url, json=query).json()
-            tmp_df = pd.DataFrame(response["data"]["accounts"])
+        # ranges over the leading hex digits of 0x addresses, the last one is open ended
+        bounds = [f"0x{int(i * 16 ** 4 / shards):04x}" for i in range(1, shards)]
+        ranges = list(zip([""] + bounds, bounds + [None]))
+
+        queue = asyncio.Queue(maxsize=2 * shards)  # bounds what pages ahead of the consumer
+
+        async def page_range(start: str, end: Optional[str]):
+            try:
+                if end is None:
+                    query = {"query": q % ("", ""), "variables": {"first": first, "id": start}}
+                else:
+                    query = {
+                        "query": q % (", $end: ID!", ", id_lt: $end"),
+                        "variables": {"first": first, "id": start, "end": end},
+                    }
+                while True:
+                    ids = [account["id"] for account in (await self.post(session, query))["accounts"]]
+                    if ids:
+                        await queue.put(ids)
+                    if len(ids) < first:
+                        break
+                    query["variables"]["id"] = ids[-1]
+                await queue.put(None)
+            except Exception as e:
+                await queue.put(e)
+
+        tasks = [asyncio.create_task(page_range(start, end)) for start, end in ranges]
+        try:
+            done = 0
+            while done < len(tasks):
+                batch = await queue.get()
+                if batch is None:
+                    done += 1
+                elif isinstance(batch, Exception):
+                    raise batch
+                else:
+                    yield batch
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def get_users_raw(
+        self, session, first: int = 1000, shards: int = 1, refresh: bool = False
+    ) -> pd.DataFrame:
+        # Checking for cache
+        if not self.users_raw.empty and not refresh:
+            return self.users_raw
 
-            df = pd.concat([df, tmp_df]).reset_index(drop=True)
+        # batches are only appended, one concat at the end
+        batches = [batch async for batch in self.iter_users(session, first, shards)]
+        df = pd.DataFrame({"id": [addr for batch in batches for addr in batch]})
+        if shards > 1:
+            df = df.sort_values(by="id").reset_index(drop=True)
 
         # Store & return
         self.users_raw = df
         return df
 
-    # Snapshots
-    async def loop_timestamp_query(self, query: Dict, session) -> pd.DataFrame:
-
-        response = await session.post(self.url, json=query)
-        response = await response.json()
-
-        # Error catching
-        if "data" not in response:
-            print(f"warning, no data: {response} {query}")
-            return pd.DataFrame()
-
-        # Case for empty response
-        df = pd.DataFrame(response["data"]["data"])
-        if df.empty:
-            print(f"warning, empty response {query}")
-            return df
+    async def spill_users_raw(
+        self,
+        session,
+        path: str,
+        first: int = 1000,
+        shards: int = 1,
+        rows_per_file: int = 1_000_000,
+    ) -> List[str]:
+        """
+        Writes account ids to parquet files under path as they arrive, for account counts too large
+        to hold in memory. Returns the files written, read them back with pd.read_parquet(path)
+        """
+        os.makedirs(path, exist_ok=True)
+        files = []
+        buffer = []
 
-        # Loop until done
-        while len(response["data"]["data"]) == query["variables"]["first"]:
+        def flush():
+            file_path = os.path.join(path, f"accounts-{len(files):05d}.parquet")
+            pd.DataFrame({"id": buffer}).to_parquet(file_path, index=False)
+            files.append(file_path)
+            buffer.clear()
 
-            # move timestamp forward
-            timestamp = int(df["timestamp"].max())
-            query["variables"]["start"] = timestamp
-            print(timestamp, pd.to_datetime(timestamp, unit="s"))  # progress bar
+        async for batch in self.iter_users(session, first, shards):
+            buffer.extend(batch)
+            if len(buffer) >= rows_per_file:
+                flush()
 
-            # Get response
-            response = await session.post(self.url, json=query)
-            response = await response.json()
+        if buffer:
+            flush()
+        return files
 
-            # handle data
-            tmp_df = pd.DataFrame(response["data"]["data"])
-            df = pd.concat([df, tmp_df]).reset_index(drop=True)
+    # Snapshots
+    async def loop_timestamp_query(self, query: Dict, session) -> pd.DataFrame:
+        """
+        Every row of a query windowed by `timestamp_gte: $start`, paged on a (timestamp, id) cursor.
+        graph-node breaks timestamp ties by id, so rows up to the cursor are dropped instead of
+        kept twice, and a timestamp holding more than `first` rows is drained by id before moving on.
+        The query has to select `id`, raises when a page comes back without data
+        """
+        if not re.search(r"(?<![\w$])id(?![\w:])", query["query"]):
+            raise ValueError(f"{self.url} timestamp paging needs the query to select id: {query['query']}")
+
+        first = query["variables"]["first"]
+        drain_query = {
+            "query": query["query"]
+            .replace("timestamp_gte: $start", "timestamp: $start, id_gt: $id")
+            .replace("query(", "query($id: ID!, ", 1),
+            "variables": dict(query["variables"]),
+        }
 
-        # Clean & return
-        # TODO: fix this
-        # TODO: or maybe drop duplicate IDs bc there should be no repeat there
-        # df = df.drop_duplicates() # Should be handled outside of this function ?? -- gonna cause issues
-        return df
+        pages = []  # page buffers, concatenated once at the end
+        cursor = None  # (timestamp, id) of the last row kept
+        cursors = set()
+
+        while True:
+            page = (await self.post(session, query))["data"]
+            pages.append(
+                [row for row in page if cursor is None or (int(row["timestamp"]), row["id"]) > cursor]
+            )
+            if len(page) < first:
+                break
+
+            last = (int(page[-1]["timestamp"]), page[-1]["id"])
+            if last == cursor:
+                # a full page at one timestamp, page through it by id and continue past it
+                pages.extend(await self.drain_timestamp(session, drain_query, *cursor))
+                query["variables"]["start"] = cursor[0] + 1
+                cursor = None
+                continue
+
+            if last in cursors:
+                raise RuntimeError(f"{self.url} timestamp cursor {last} repeated, stopping {query}")
+            cursors.add(last)
+
+            cursor = last
+            query["variables"]["start"] = last[0]
+
+        return pd.DataFrame([row for page in pages for row in page])
+
+    async def drain_timestamp(
+        self, session, query: Dict, timestamp: int, id: str
+    ) -> List[List[Dict]]:
+        """Pages of rows at exactly timestamp with ids after id"""
+        query["variables"].update({"start": timestamp, "id": id})
+        pages = []
+
+        while True:
+            page = (await self.post(session, query))["data"]
+            pages.append(page)
+            if len(page) < query["variables"]["first"]:
+                return pages
+            query["variables"]["id"] = page[-1]["id"]
 
     async def get_usage_snapshots(
         self,
@@ -123,6 +220,7 @@ class Subgraph:
         q = """
             query($first: Int, $start: Int, $end: Int) {
               data: usageMetricsDailySnapshots (first: $first, orderDirection: asc, orderBy: timestamp, where: {timestamp_gte: $start, timestamp_lt: $end}) {
+                id
                 protocol {
                   name
                 }
@@ -150,4 +248,4 @@ class Subgraph:
         df["protocol"] = df["protocol"].apply(lambda x: x.get("name"))
         df["firstTimeUsers"] = df["totalUniqueUsers"].diff()
         self.usage_snapshots = df
-        return df
\ No newline at end of file
+        return df
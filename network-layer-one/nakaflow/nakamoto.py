@@ -0,0 +1,217 @@
+"""
+Nakamoto coefficient engine,
+shared by nakaflow and the network-layer-one dashboard
+"""
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+
+def _quantile(
+    authored: np.ndarray, starts: np.ndarray, counts: np.ndarray, q: float
+) -> np.ndarray:
+    """
+    Linear interpolated quantile per period,
+    where each period's values sit descending from its start
+    """
+    position = q * np.maximum(counts - 1, 0)
+    lower = np.floor(position).astype(int)
+    upper = np.ceil(position).astype(int)
+
+    # ascending position k sits at descending position count - 1 - k
+    last = starts + np.maximum(counts - 1, 0)
+    lower_value = authored[last - lower]
+    upper_value = authored[last - upper]
+
+    value = lower_value + (upper_value - lower_value) * (position - lower)
+    return np.where(counts > 0, value, np.nan)
+
+
+Thresholds = Union[float, Sequence[float]]
+
+
+def nakamoto_column(threshold: float) -> str:
+    """Column holding the realized nakamoto coefficient at threshold, e.g. nakamoto_realized_33"""
+    return f"nakamoto_realized_{round(threshold * 100)}"
+
+
+def nakamoto_stats_sparse(
+    periods: np.ndarray, values: np.ndarray, n_periods: int, thresholds: Thresholds = 0.33
+) -> pd.DataFrame:
+    """
+    Realized nakamoto coefficients, concentration and blocks authored stats per period,
+    from (period, blocks created) entries with periods numbered 0..n_periods - 1.
+    Every threshold gets a nakamoto_column, nakamoto_realized is the first one.
+    Non-positive entries are not counted as authors,
+    memory scales with the number of entries rather than authors x periods.
+    """
+    thresholds = [thresholds] if np.isscalar(thresholds) else list(thresholds)
+    periods = np.asarray(periods, dtype=int)
+    values = np.asarray(values, dtype=float)
+
+    keep = values > 0
+    periods, values = periods[keep], values[keep]
+
+    # largest authors first within each period
+    order = np.lexsort((-values, periods))
+    periods, authored = periods[order], values[order]
+
+    counts = np.bincount(periods, minlength=n_periods)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(int)
+    totals = np.bincount(periods, weights=authored, minlength=n_periods)
+
+    # a trailing slot so periods without authors still index somewhere, they are masked below
+    padded = np.append(authored, 0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = totals / counts
+        squares = np.bincount(periods, weights=(authored - mean[periods]) ** 2, minlength=n_periods)
+        std = np.where(counts > 1, np.sqrt(squares / (counts - 1)), np.nan)
+
+        # one cumulative share serves every threshold
+        cumulative = np.cumsum(authored)
+        offsets = np.concatenate([[0], cumulative])[starts]
+        share = (cumulative - np.repeat(offsets, counts)) / totals[periods]
+        nakamoto = {
+            nakamoto_column(threshold): np.bincount(periods, weights=share < threshold, minlength=n_periods)
+            .astype(int) + 1
+            for threshold in thresholds
+        }
+
+        # gini from descending ranks, rank r of n is ascending position n - r
+        rank = np.arange(len(authored)) - np.repeat(starts, counts)
+        weighted = np.bincount(periods, weights=(counts[periods] - rank) * authored, minlength=n_periods)
+        gini = 2 * weighted / (counts * totals) - (counts + 1) / counts
+        hhi = np.bincount(periods, weights=(authored / totals[periods]) ** 2, minlength=n_periods)
+
+    has_authors = counts > 0
+
+    return pd.DataFrame(
+        {
+            "author_count": counts,
+            "nakamoto_realized": nakamoto[nakamoto_column(thresholds[0])],
+            **nakamoto,
+            "sum": totals,
+            "mean": mean,
+            "median": _quantile(padded, starts, counts, 0.5),
+            "max": np.where(has_authors, padded[starts], np.nan),
+            "min": np.where(has_authors, padded[starts + np.maximum(counts - 1, 0)], np.nan),
+            "std": std,
+            "q3": _quantile(padded, starts, counts, 0.75),
+            "q1": _quantile(padded, starts, counts, 0.25),
+            "gini": np.where(has_authors, gini, np.nan),
+            "hhi": np.where(has_authors, hhi, np.nan),
+        }
+    )
+
+
+GRANULARITIES = ["monthly", "weekly", "daily", "blocks"]
+
+
+def period_heights(
+    snapshots: pd.DataFrame,
+    granularity: str = "monthly",
+    every_n_blocks: int = 100000,
+    datetime_col: str = "datetime",
+    height_col: str = "blockHeight",
+) -> List[int]:
+    """
+    Block heights starting each nakamoto period, the first snapshot of every
+    calendar month, week or day, or past every multiple of every_n_blocks.
+    Snapshots are taken to be evenly spaced, at their median interval
+    """
+    df = snapshots[[datetime_col, height_col]].sort_values(by=height_col)
+    dates = pd.to_datetime(df[datetime_col])
+
+    if granularity == "blocks":
+        keys = df[height_col] // every_n_blocks
+    elif granularity in ("monthly", "weekly", "daily"):
+        keys = dates.dt.to_period({"monthly": "M", "weekly": "W", "daily": "D"}[granularity])
+    else:
+        raise ValueError(f"unknown granularity {granularity}, expected one of {GRANULARITIES}")
+
+    starts = ~keys.duplicated().to_numpy()
+    if not len(starts):
+        return []
+
+    # snapshots rarely begin on a period boundary, a partial first period is left out.
+    # The first snapshot starts its period when it falls within one snapshot interval of it
+    if granularity == "blocks":
+        starts[0] = df[height_col].iloc[0] % every_n_blocks == 0
+    else:
+        interval = dates.diff().median() if len(dates) > 1 else pd.Timedelta(0)
+        starts[0] = dates.iloc[0] - keys.iloc[0].start_time < interval
+
+    return [int(height) for height in df.loc[starts, height_col]]
+
+
+def period_deltas(
+    authors: pd.DataFrame,
+    periods: List[Tuple[int, int]],
+    value: str = "cumulativeBlocksCreated",
+) -> pd.DataFrame:
+    """
+    Long format (from_height, height, id, delta) of each author's value over each period,
+    from a long format (height, id, value) author table.
+    Authors missing at either end of a period are left out of it.
+    """
+    df = authors[["height", "id", value]].sort_values(by=["id", "height"])
+    df["delta"] = df.groupby("id")[value].diff()
+    df["from_height"] = df.groupby("id")["height"].shift()
+
+    # an author's previous height only counts when it is the start of the period
+    df = df.dropna(subset=["from_height"])
+    df["from_height"] = df["from_height"].astype("int64")
+    df["height"] = df["height"].astype("int64")
+    ends = pd.DataFrame(periods, columns=["from_height", "height"], dtype="int64")
+
+    return df.merge(ends, on=["from_height", "height"])[["from_height", "height", "id", "delta"]]
+
+
+def period_stats(
+    deltas: pd.DataFrame, periods: List[Tuple[int, int]], thresholds: Thresholds = 0.33
+) -> pd.DataFrame:
+    """Nakamoto stats per period from period_deltas, indexed by (from_height, height)"""
+    index = pd.MultiIndex.from_tuples(periods, names=["from_height", "height"])
+    codes = index.get_indexer(pd.MultiIndex.from_frame(deltas[["from_height", "height"]]))
+
+    stats = nakamoto_stats_sparse(codes, deltas["delta"].to_numpy(dtype=float), len(index), thresholds)
+    stats.index = index
+    return stats
+
+
+def settle_nakamoto(
+    authored: np.ndarray, bound: float, max_total: float, threshold: float = 0.33
+) -> Optional[int]:
+    """
+    Realized nakamoto coefficient from the authors seen so far, once unseen authors can't change it.
+    Every unseen author created at most `bound` blocks in the period
+    and all authors together at most `max_total`.
+    Returns None while the result is still open.
+    """
+    authored = np.asarray(authored, dtype=float)
+    authored = -np.sort(-authored[authored > 0])
+    seen = authored.sum()
+    max_total = max(max_total, seen)
+    if max_total <= 0:
+        return 1
+
+    # prefix[k] is the top k seen authors, a lower bound for the top k of all authors
+    prefix = np.concatenate([[0], np.cumsum(authored)])
+    reached = np.nonzero(prefix[1:] >= threshold * max_total)[0]
+    if len(reached) == 0:
+        return None
+    n = reached[0] + 1
+
+    # the top n - 1 of all authors must stay under the threshold for every unseen total,
+    # the margin is piecewise linear in the unseen total so its breakpoints are enough to check
+    unseen_max = max_total - seen
+    seen_taken = np.arange(min(n - 1, len(authored)) + 1)
+    breakpoints = (n - 1 - seen_taken) * bound
+    for unseen in np.concatenate([[0, unseen_max], breakpoints[breakpoints < unseen_max]]):
+        top = (prefix[seen_taken] + np.minimum((n - 1 - seen_taken) * bound, unseen)).max()
+        if top >= threshold * (seen + unseen):
+            return None
+
+    return int(n)
@@ -1,16 +1,35 @@
-import requests
 import pandas as pd
-from aiohttp import ClientSession
+from aiohttp import ClientError, ClientSession
 import asyncio
 import datetime
+import os
+import random
+import time
+from typing import Callable, Dict, List, Optional, Union
 
 from messygraphs.subgraph import Subgraph
+from batching import BatchSizer, build_batch_query
+from limiter import AdaptiveLimiter
+from nakamoto import nakamoto_column, period_deltas, period_heights, period_stats
 
 
 class Network(Subgraph):
-    def __init__(self, url: str, nakamoto: float = 0.33):
+    def __init__(
+        self,
+        url: str,
+        nakamoto: Union[float, List[float]] = 0.33,
+        authors_chunk: int = 50,
+        store_dir: Optional[str] = None,
+        granularity: str = "monthly",
+        every_n_blocks: int = 100000,
+    ):
         Subgraph.__init__(self, url)
-        self.nakamoto = nakamoto
+        self.nakamoto = [nakamoto] if isinstance(nakamoto, (int, float)) else list(nakamoto)  # first is the headline threshold
+        self.authors_chunk = authors_chunk  # heights per get_authors call
+        self.store_dir = store_dir  # authors by height are persisted here when set
+        self.granularity = granularity  # nakamoto periods, see nakamoto.GRANULARITIES
+        self.every_n_blocks = every_n_blocks
+        self.authors_limit = 4  # in-flight author requests, carried over from the last run
 
         # Snapshots
         # NOTE: maybe all snaps should be abstracted away
@@ -98,6 +117,7 @@ class Network(Subgraph):
         df["date"] = df["datetime"].apply(lambda x: x.date())
 
         # Casting
+        df["blockHeight"] = df["blockHeight"].astype(int)
         df["dailyGasUsed"] = df["dailyGasUsed"].astype(float)
         df["dailyGasLimit"] = df["dailyGasLimit"].astype(float)
         df["dailyRewards"] = df["dailyRewards"].astype(float)
@@ -121,62 +141,123 @@ class Network(Subgraph):
         return
 
     #### Authors
+    def authors_store_path(self) -> Optional[str]:
+        if not self.store_dir:
+            return None
+        return os.path.join(self.store_dir, f"{self.url.rstrip('/').split('/')[-1]}.authors.parquet")
+
+    def read_stored_authors(self, heights: List[int]) -> pd.DataFrame:
+        path = self.authors_store_path()
+        if not path or not os.path.isfile(path) or not heights:
+            return pd.DataFrame(
+                columns=["id", "cumulativeDifficulty", "cumulativeBlocksCreated", "height"]
+            )
+        return pd.read_parquet(path, filters=[("height", "in", heights)])
+
+    def store_authors(self, dfs: List[pd.DataFrame]):
+        path = self.authors_store_path()
+        if not path or not dfs:
+            return
+
+        if os.path.isfile(path):
+            dfs = [pd.read_parquet(path), *dfs]
+        df = pd.concat(dfs).drop_duplicates(subset=["height", "id"], keep="last")
+        df.sort_values(by=["height", "id"]).to_parquet(path, index=False)
+
+    async def post_query(
+        self, session, limiter: AdaptiveLimiter, query: Dict, retries: int = 5
+    ) -> Dict:
+        """
+        Response data of a query sent through the limiter,
+        throttled, failed and errored attempts back it off and are retried
+        """
+        for attempt in range(retries + 1):
+            await limiter.acquire()
+            start = time.monotonic()
+            data = None
+            try:
+                async with session.post(self.url, json=query) as response:
+                    if 400 <= response.status < 500 and response.status != 429:
+                        raise ValueError(f"{self.url} http {response.status}: {await response.text()}")
+
+                    body = await response.json(content_type=None) if response.status < 400 else {}
+                    data = body.get("data") if "errors" not in body else None
+                    error = body.get("errors", f"http {response.status}")
+            except (ClientError, asyncio.TimeoutError) as e:
+                error = repr(e)
+            finally:
+                await limiter.release(time.monotonic() - start if data is not None else None)
+
+            if data is not None:
+                return data
+            if attempt < retries:
+                await asyncio.sleep(random.uniform(0.5, 1) * 2 ** attempt)
+
+        raise RuntimeError(f"{self.url} query failed after {retries} retries: {error}")
+
     async def get_authors(
-        self, session, sem, height: int, first: int = 1000, refresh: bool = False
+        self,
+        session,
+        limiter: AdaptiveLimiter,
+        heights: List[int],
+        first: int = 1000,
+        refresh: bool = False,
     ) -> pd.DataFrame:
-        q = """
-            query($first: Int, $skip: Int, $height: Int) {
-              data: authors(first: $first, skip: $skip, orderDirection: asc, orderBy: id, block: {number: $height}) {
+        """Authors at each of heights, several heights aliased into one request"""
+        selection = """
+            {
                 id
                 cumulativeDifficulty
                 cumulativeBlocksCreated
-              }
             }
         """
-        skip = 0
-        query = {
-            "query": q,
-            "variables": {
-                "first": first,
-                "skip": skip,
-                "height": height,
-            },
+        root_fields = {
+            f"h{height}": "authors(first: $first, orderDirection: asc, orderBy: id, "
+            f"where: {{id_gt: $cursor}}, block: {{number: {height}}})"
+            for height in heights
         }
-        await sem.acquire()
-        print(len(asyncio.all_tasks()), "0x0")
-        await asyncio.sleep(1)
-
-        response = await session.post(self.url, json=query)
-        response = await response.json()
-        sem.release()
-
-        df = pd.DataFrame(response["data"]["data"])
-        while len(response["data"]["data"]) == first:
-            skip += 1000
+        alias_heights = {f"h{height}": height for height in heights}
+
+        sizer = BatchSizer()
+        pending = {alias: "" for alias in root_fields}  # alias -> id cursor
+        records = []
+        while pending:
+            batch = dict(list(pending.items())[: sizer.size])
+            query = build_batch_query(
+                {alias: root_fields[alias] for alias in batch}, selection, batch, first
+            )
 
-            await sem.acquire()
-            print(len(asyncio.all_tasks()), df["id"].max())
-            await asyncio.sleep(1)
+            response = await self.post_query(session, limiter, query)
 
-            query["variables"]["skip"] = skip  # iterate to next address
-            response = await session.post(self.url, json=query)
-            response = await response.json()
-            sem.release()
+            rows = 0
+            for alias in batch:
+                data = response[alias]
+                records.extend({**author, "height": alias_heights[alias]} for author in data)
+                rows += len(data)
 
-            response = requests.post(self.url, json=query).json()
-            tmp_df = pd.DataFrame(response["data"]["data"])
+                if len(data) == first:
+                    pending[alias] = max(author["id"] for author in data)
+                else:
+                    del pending[alias]
+            sizer.update(rows)
 
-            df = pd.concat([df, tmp_df]).reset_index(drop=True)
+        df = pd.DataFrame(
+            records,
+            columns=["id", "cumulativeDifficulty", "cumulativeBlocksCreated", "height"],
+        )
 
         # Casting
         df["cumulativeDifficulty"] = df["cumulativeDifficulty"].astype(float)
         df["cumulativeBlocksCreated"] = df["cumulativeBlocksCreated"].astype(float)
-
-        # metadata, NOTE: maybe store this as an attribute?
-        df["height"] = height
         return df
 
-    async def get_author_snapshots(self, refresh: bool = False) -> pd.DataFrame:
+    async def get_author_snapshots(
+        self, refresh: bool = False, progress: Optional[Callable[[int, int], None]] = None
+    ) -> pd.DataFrame:
+        """
+        Authors at the start of every nakamoto period, one row per (height, author).
+        progress is called with (heights fetched, heights missing) as chunks complete
+        """
         if not self.author_snapshots.empty and not refresh:
             return self.author_snapshots
 
@@ -187,21 +268,36 @@ class Network(Subgraph):
             daily_snapshots["timestamp"], unit="s"
         )
 
-        ### Getting start of months, day = 1
-        dates = daily_snapshots["datetime"].apply(lambda x: x.date())
-        days = dates.apply(lambda x: x.day)
+        # first block of every month, week, day or N blocks
+        blocks = period_heights(daily_snapshots, self.granularity, self.every_n_blocks)
+
+        # authors at past heights never change, only fetch the ones not stored yet
+        stored = self.read_stored_authors(blocks)
+        missing = sorted(set(blocks) - set(stored["height"]))
+
+        fetched = 0
+
+        async def get_chunk(session, limiter, heights: List[int]) -> pd.DataFrame:
+            nonlocal fetched
+            df = await self.get_authors(session, limiter, heights)
 
-        # This should be a list of blocks where they happened the first of the month
-        # NOTE, may have to ignore the first one because 0's can be weird
-        blocks = daily_snapshots[days == 1]["blockHeight"].tolist()
+            fetched += len(heights)
+            if progress:
+                progress(fetched, len(missing))
+            return df
 
         async with ClientSession() as session:
-            sem = asyncio.Semaphore(value=10)
+            limiter = AdaptiveLimiter(initial=self.authors_limit)
             dfs = await asyncio.gather(
-                *[self.get_authors(session, sem, height) for height in blocks]
+                *[
+                    get_chunk(session, limiter, missing[i : i + self.authors_chunk])
+                    for i in range(0, len(missing), self.authors_chunk)
+                ]
             )
+            self.authors_limit = limiter.limit
 
-        df = pd.concat(dfs).reset_index(drop=True)
+        self.store_authors(dfs)
+        df = pd.concat([stored, *dfs]).reset_index(drop=True)
 
         block_timestamp_dict = (
             daily_snapshots[["blockHeight", "datetime"]]
@@ -212,72 +308,52 @@ class Network(Subgraph):
             lambda x: block_timestamp_dict["datetime"][x]
         )
 
-        df = df.set_index(["height", "datetime", "id"])  # set index as (height, id)
-        df = df.unstack()  # Move index id to columns
-        df = df.swaplevel(axis=1).sort_index(axis=1)  # swap & sort columns
+        # kept long, one row per (height, author), instead of an authors x heights matrix
+        df = df.sort_values(by=["height", "id"]).reset_index(drop=True)
 
         self.author_snapshots = df
         return df
 
-    async def get_author_stats(self, refresh: bool = False) -> pd.DataFrame:
+    async def get_author_stats(
+        self, refresh: bool = False, progress: Optional[Callable[[int, int], None]] = None
+    ) -> pd.DataFrame:
         if not self.author_stats.empty and not refresh:
             return self.author_stats
 
-        df = await self.get_author_snapshots(refresh=refresh)
-
-        df = df.diff()  # get diff over time
-        df = df.xs("cumulativeBlocksCreated", axis=1, level=1)  # grab blocks created
-        df = df.iloc[1:]  # drop the first one
-
-        tmp_list = []
-        for idx, row in df.iterrows():
-            date = idx[1].date()
-
-            # TODO, drop 0s from row
-            row = row[row > 0]
-
-            author_count = len(row)
-
-            # get stats about block mining
-            blocks_mined_total = row.sum()
-            blocks_mined_median = row.median()
-            blocks_mined_mean = row.mean()
-
-            blocks_mined_max = row.max()
-            blocks_mined_min = row.min()
-
-            blocks_mined_std = row.std()
-
-            blocks_mined_q3 = row.quantile(0.75)
-            blocks_mined_q1 = row.quantile(0.25)
-
-            # Getting realized nakamoto
-            authored = row.sort_values(ascending=False).to_frame(name="authored")
-            authored["authored.cumulative"] = authored["authored"].cumsum()
-            authored["pct"] = authored["authored"] / blocks_mined_total
-            authored["pct.cumulative"] = authored["pct"].cumsum()
-
-            realized_nakamoto = (
-                len(authored[authored["pct.cumulative"] < self.nakamoto]) + 1
-            )
-
-            # NOTE: consider normalizing this to pct so the charts are simplier
-            tmp_dict = {
-                "date": date,
-                "author.count": author_count,
-                "nakamoto.realized": realized_nakamoto,
-                "blocks.authored.total": blocks_mined_total,
-                "blocks.authored.mean": blocks_mined_mean,
-                "blocks.authored.median": blocks_mined_median,
-                "blocks.authored.max": blocks_mined_max,
-                "blocks.authored.min": blocks_mined_min,
-                "blocks.authored.std": blocks_mined_std,
-                "blocks.authored.q3": blocks_mined_q3,
-                "blocks.authored.q1": blocks_mined_q1,
+        df = await self.get_author_snapshots(refresh=refresh, progress=progress)
+
+        # blocks created between consecutive heights, per author present at both
+        heights = sorted(df["height"].unique())
+        periods = list(zip(heights, heights[1:]))
+        deltas = period_deltas(df, periods)
+
+        stats = period_stats(deltas, periods, self.nakamoto)
+        stats = stats.rename(
+            columns={
+                "author_count": "author.count",
+                "nakamoto_realized": "nakamoto.realized",
+                **{
+                    nakamoto_column(threshold): f"nakamoto.realized.{round(threshold * 100)}"
+                    for threshold in self.nakamoto
+                },
+                "sum": "blocks.authored.total",
+                "mean": "blocks.authored.mean",
+                "median": "blocks.authored.median",
+                "max": "blocks.authored.max",
+                "min": "blocks.authored.min",
+                "std": "blocks.authored.std",
+                "q3": "blocks.authored.q3",
+                "q1": "blocks.authored.q1",
+                "gini": "blocks.authored.gini",
+                "hhi": "blocks.authored.hhi",
             }
-            tmp_list.append(tmp_dict)
-
-        stats = pd.DataFrame(tmp_list)
+        )
+        # NOTE: consider normalizing this to pct so the charts are simplier
+        datetimes = df.drop_duplicates("height").set_index("height")["datetime"]
+        stats.insert(
+            0, "date", datetimes.reindex(stats.index.get_level_values("height")).dt.date.to_numpy()
+        )
+        stats = stats.reset_index(drop=True)
         self.author_stats = stats
         return stats
 
@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import traceback
+
+import config
+import client
+import fetchers
+import store
+
+
+# Headless snapshot refresher
+#
+#   python refresher.py                      # keep every frequency in sync on config.refresh_interval
+#   python refresher.py --once               # sync once and exit
+#   python refresher.py --frequency hourly   # only hourly snapshots
+#
+# runs the same incremental update as the dashboard's refresh button, writes through the
+# snapshot store (so refreshes in other processes are skipped, not raced) and keeps its
+# status in snapshots/refresher.json
+
+
+def next_run_at(frequency, after):
+    return after + config.refresh_interval[frequency] + random.uniform(0, config.refresh_jitter)
+
+
+def sync(frequency, status):
+    started = time.time()
+    status[frequency] = {**status.get(frequency, {}), "state": "running", "started": int(started)}
+    store.write_refresher_status(status)
+
+    try:
+        results = client.run(fetchers.update_snapshots_all_networks([frequency]))
+        state = "ok" if all(result in ("updated", "skipped") for result in results.values()) else "partial"
+    except Exception:
+        logging.error(f">> {frequency} sync failed\n{traceback.format_exc()}")
+        results, state = {}, "failed"
+
+    finished = time.time()
+    status[frequency] = {
+        "state": state,
+        "started": int(started),
+        "finished": int(finished),
+        "duration": round(finished - started, 1),
+        "next_run": int(next_run_at(frequency, started)),
+        "results": results,
+    }
+    store.write_refresher_status(status)
+
+    logging.info(f">> {frequency} sync {state} in {finished - started:.1f} seconds")
+
+
+def run(frequencies, once=False):
+    status = store.read_refresher_status()
+    status["pid"] = os.getpid()
+
+    # a restarted refresher picks up the schedule it left in the status file
+    now = time.time()
+    next_runs = {
+        frequency: min(status.get(frequency, {}).get("next_run", now), now + config.refresh_interval[frequency])
+        for frequency in frequencies
+    }
+
+    while True:
+        for frequency in frequencies:
+            if once or next_runs[frequency] <= time.time():
+                sync(frequency, status)
+                next_runs[frequency] = status[frequency]["next_run"]
+
+        if once:
+            return status
+
+        time.sleep(max(min(next_runs.values()) - time.time(), 1))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+
+    parser = argparse.ArgumentParser(description="Keep network snapshots up to date outside the dashboard")
+    parser.add_argument("--frequency", choices=store.FREQUENCIES, action="append",
+                        help="frequencies to sync, all of them by default")
+    parser.add_argument("--once", action="store_true", help="sync once and exit")
+    args = parser.parse_args()
+
+    run(args.frequency or store.FREQUENCIES, once=args.once)
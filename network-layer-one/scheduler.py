@@ -0,0 +1,153 @@
+import time
+import heapq
+import random
+import asyncio
+import logging
+import weakref
+import itertools
+from contextlib import asynccontextmanager
+from aiohttp import ClientError
+
+import config
+
+
+# request lanes, lower goes first
+INTERACTIVE = 0
+BULK = 1
+
+
+class QueryError(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class PriorityGate:
+    # a semaphore that hands freed slots to the lowest lane first, and keeps `reserved`
+    # slots that only interactive requests may take
+    def __init__(self, size, reserved):
+        self.size = size
+        self.bulk_size = max(size - reserved, 1)
+        self.in_use = 0
+        self.waiters = []
+        self.counter = itertools.count()
+
+    def available(self, lane):
+        return self.in_use < (self.size if lane == INTERACTIVE else self.bulk_size)
+
+    async def acquire(self, lane):
+        if self.available(lane) and (not self.waiters or self.waiters[0][0] > lane):
+            self.in_use += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (lane, next(self.counter), waiter)
+        heapq.heappush(self.waiters, entry)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if entry in self.waiters:
+                self.waiters.remove(entry)
+                heapq.heapify(self.waiters)
+            else:
+                self.release()
+            raise
+
+    def release(self):
+        self.in_use -= 1
+
+        while self.waiters and self.available(self.waiters[0][0]):
+            lane, _, waiter = heapq.heappop(self.waiters)
+            self.in_use += 1
+            waiter.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, lane):
+        await self.acquire(lane)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class Scheduler:
+    # paces requests to a single deployment and retries transient failures, so a page
+    # is either returned in full or the whole query fails instead of coming back truncated
+    def __init__(self, network):
+        limits = {**config.default_rate_limit, **config.rate_limits.get(network, {})}
+
+        self.network = network
+        self.url = config.deployments[network]
+        self.bucket = TokenBucket(limits["rate"], limits["burst"])
+        self.in_flight = PriorityGate(limits["max_in_flight"], limits["reserved_interactive"])
+
+    async def attempt(self, session, query, lane):
+        async with self.in_flight.slot(lane):
+            await self.bucket.acquire()
+
+            try:
+                async with session.post(self.url, json=query) as response:
+                    if response.status == 429 or response.status >= 500:
+                        return None, f"http {response.status}", retry_after(response)
+                    if response.status >= 400:
+                        raise QueryError(f"{self.network} http {response.status}: {await response.text()}")
+
+                    response = await response.json(content_type=None)
+                    if "data" not in response or "errors" in response:
+                        return None, response.get("errors", response), 0
+
+                    return response["data"], None, 0
+            except (ClientError, asyncio.TimeoutError) as e:
+                return None, repr(e), 0
+
+    async def post(self, session, query, lane=BULK):
+        for attempt in range(config.max_retries + 1):
+            data, error, wait = await self.attempt(session, query, lane)
+            if error is None:
+                return data
+
+            if attempt == config.max_retries:
+                break
+
+            backoff = min(config.retry_backoff_max, config.retry_backoff_base * 2 ** attempt)
+            delay = max(wait, random.uniform(backoff / 2, backoff))
+            logging.warning(f">> {self.network} query failed ({error}), retry {attempt + 1} in {delay:.1f} seconds")
+            await asyncio.sleep(delay)
+
+        raise QueryError(f"{self.network} query failed after {config.max_retries} retries: {error}")
+
+
+def retry_after(response):
+    value = response.headers.get("Retry-After", "")
+
+    return float(value) if value.isdigit() else 0
+
+
+# schedulers hold asyncio primitives, so they are kept per event loop
+_schedulers = weakref.WeakKeyDictionary()
+
+
+def get_scheduler(network):
+    schedulers = _schedulers.setdefault(asyncio.get_running_loop(), {})
+    if network not in schedulers:
+        schedulers[network] = Scheduler(network)
+
+    return schedulers[network]
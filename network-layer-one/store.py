@@ -0,0 +1,387 @@
+import os
+import sys
+import json
+import glob
+import time
+import logging
+import tempfile
+import contextlib
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # no advisory locks on windows, writes are still atomic
+    fcntl = None
+
+import config
+
+SNAPSHOTS_DIR = os.path.join(os.path.dirname(__file__), "snapshots")
+AUTHORS_DIR = os.path.join(os.path.dirname(__file__), "authors")
+AUTHOR_COLUMNS = ["height", "id", "cumulativeDifficulty", "cumulativeBlocksCreated"]
+FREQUENCIES = ["daily", "hourly"]
+PERIOD_SECONDS = {"daily": 24 * 60 * 60, "hourly": 60 * 60}
+ROW_GROUP_SIZE = 1000
+AUTHOR_PARTS_MAX = 64
+
+
+def snapshot_path(network, frequency):
+    return os.path.join(SNAPSHOTS_DIR, frequency, f"{network}.parquet")
+
+
+def json_snapshot_path(network, frequency):
+    return os.path.join(SNAPSHOTS_DIR, frequency, f"{network}.json")
+
+
+def flatten_snapshots(records, frequency):
+    # flattens the stats structs into `{frequency}{metric}.{stat}` columns and types everything,
+    # subgraph BigInt / BigDecimal values come back as strings
+    df = pd.json_normalize(records)
+    if df.empty:
+        return df
+
+    for col in df.columns:
+        if col != "id":
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+
+    int_cols = [col for col in ["blockHeight", f"{frequency}Blocks", "timestamp"] if col in df.columns]
+    df[int_cols] = df[int_cols].fillna(0).astype("int64")
+    df["id"] = df["id"].astype(str)
+
+    return df
+
+
+def manifest_path():
+    return os.path.join(SNAPSHOTS_DIR, "manifest.json")
+
+
+def atomic_write(file_path, write):
+    # write(path) fills a temp file next to file_path which then replaces it,
+    # so readers see either the old file or the new one and never a partial write
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix=f".{os.path.basename(file_path)}.")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.chmod(tmp_path, 0o644)  # mkstemp files are private to the owner
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return file_path
+
+
+@contextlib.contextmanager
+def file_lock(file_path, blocking=True):
+    # advisory lock on a `.lock` file next to file_path, yields whether it was taken
+    with open(f"{file_path}.lock", "a") as lock_file:
+        if fcntl is None:
+            yield True
+            return
+
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def snapshot_lock(network, frequency):
+    # held by whoever refreshes a network's snapshots, from reading the cursor to the write,
+    # so concurrent refreshes of the same file don't race; yields False when already held
+    return file_lock(snapshot_path(network, frequency), blocking=False)
+
+
+def refresher_status_path():
+    return os.path.join(SNAPSHOTS_DIR, "refresher.json")
+
+
+def read_refresher_status():
+    try:
+        with open(refresher_status_path(), "r") as openfile:
+            return json.load(openfile)
+    except FileNotFoundError:
+        return {}
+
+
+def write_refresher_status(status):
+    def write(file_path):
+        with open(file_path, "w") as outfile:
+            json.dump(status, outfile, indent=2, sort_keys=True)
+
+    return atomic_write(refresher_status_path(), write)
+
+
+def read_manifest():
+    try:
+        with open(manifest_path(), "r") as openfile:
+            return json.load(openfile)
+    except FileNotFoundError:
+        return {}
+
+
+def snapshot_watermark(network, frequency):
+    # latest id, timestamp and block height and the row count of a snapshot file,
+    # without opening it; None when it was never written
+    return read_manifest().get(f"{frequency}/{network}")
+
+
+def merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    return merged
+
+
+def missing_ranges(covered, start, end):
+    # parts of [start, end) not in any of the covered [from, to) ranges
+    gaps = []
+    cursor = start
+    for range_start, range_end in merge_ranges(covered):
+        if range_start >= end:
+            break
+        if range_start > cursor:
+            gaps.append([cursor, range_start])
+        cursor = max(cursor, range_end)
+
+    if cursor < end:
+        gaps.append([cursor, end])
+
+    return gaps
+
+
+def snapshot_ranges(network, frequency):
+    # [from, to) timestamp ranges the stored snapshots are complete over
+    watermark = snapshot_watermark(network, frequency)
+    if watermark and "ranges" in watermark:
+        return watermark["ranges"]
+
+    # files written before ranges were recorded came from a whole history sync
+    if watermark:
+        latest = watermark["max_timestamp"]
+    elif has_snapshots(network, frequency):
+        latest = read_snapshots(network, frequency, columns=["timestamp"])["timestamp"].max()
+    else:
+        return []
+
+    return [[0, int(latest) + 1]] if latest is not None and not pd.isna(latest) else []
+
+
+def update_manifest(network, frequency, df, ranges=None):
+    # ranges are kept from the previous entry when not given, df is sorted by timestamp
+    latest = df.iloc[-1] if len(df.index) else {}
+    watermark = {
+        "max_id": str(latest["id"]) if "id" in latest else None,
+        "max_timestamp": int(latest["timestamp"]) if "timestamp" in latest else None,
+        "block_height": int(df["blockHeight"].max()) if "blockHeight" in df.columns and len(df.index) else None,
+        "rows": len(df.index),
+        "updated": int(time.time()),
+    }
+
+    with file_lock(manifest_path()):
+        manifest = read_manifest()
+
+        previous = manifest.get(f"{frequency}/{network}", {})
+        if ranges is not None:
+            # the subgraph can lag behind the clock, so nothing past the latest snapshot it
+            # returned counts as covered and a later fetch asks for it again
+            covered_until = watermark["max_timestamp"] + 1 if watermark["max_timestamp"] is not None else 0
+            watermark["ranges"] = [
+                [start, min(end, covered_until)] for start, end in merge_ranges(ranges) if start < covered_until
+            ]
+        elif "ranges" in previous:
+            watermark["ranges"] = previous["ranges"]
+
+        manifest[f"{frequency}/{network}"] = watermark
+
+        def write(file_path):
+            with open(file_path, "w") as outfile:
+                json.dump(manifest, outfile, indent=2, sort_keys=True)
+
+        atomic_write(manifest_path(), write)
+
+    return watermark
+
+
+def has_snapshots(network, frequency):
+    return os.path.isfile(snapshot_path(network, frequency)) or os.path.isfile(json_snapshot_path(network, frequency))
+
+
+def snapshot_version(network, frequency):
+    file_path = snapshot_path(network, frequency)
+    if not os.path.isfile(file_path):
+        return None
+
+    stat = os.stat(file_path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def read_snapshots(network, frequency, columns=None, from_unix=None, to_unix=None):
+    file_path = snapshot_path(network, frequency)
+    if not os.path.isfile(file_path):
+        if not os.path.isfile(json_snapshot_path(network, frequency)):
+            return pd.DataFrame()
+        migrate_json_snapshots(network, frequency)
+
+    filters = []
+    if from_unix is not None:
+        filters.append(("timestamp", ">=", int(from_unix)))
+    if to_unix is not None:
+        filters.append(("timestamp", "<=", int(to_unix)))
+
+    return pd.read_parquet(file_path, columns=columns, filters=filters or None)
+
+
+def write_snapshots(network, frequency, df, ranges=None):
+    if df.empty:
+        # keep the timestamp column so reads with a window filter still work
+        df = pd.DataFrame({"id": pd.Series(dtype="str"), "timestamp": pd.Series(dtype="int64")})
+
+    df = df.sort_values(by=["timestamp", "id"])
+    file_path = atomic_write(
+        snapshot_path(network, frequency),
+        lambda tmp_path: df.to_parquet(tmp_path, index=False, row_group_size=ROW_GROUP_SIZE))
+    update_manifest(network, frequency, df, ranges)
+
+    return file_path
+
+
+def author_history_path(network):
+    # a directory of part files, one per appended chunk of heights
+    return os.path.join(AUTHORS_DIR, network)
+
+
+def legacy_author_history_path(network):
+    return os.path.join(AUTHORS_DIR, f"{network}.parquet")
+
+
+def author_stats_path(network):
+    return os.path.join(AUTHORS_DIR, f"{network}.stats.parquet")
+
+
+def append_table(file_path, df, keys):
+    # past heights never change, so new rows are merged in and the file rewritten sorted by key,
+    # under the file's lock so concurrent appends don't drop each other's rows
+    with file_lock(file_path):
+        if os.path.isfile(file_path):
+            df = pd.concat([pd.read_parquet(file_path), df])
+
+        df = df.drop_duplicates(subset=keys, keep="last").sort_values(by=keys)
+
+        return atomic_write(
+            file_path, lambda tmp_path: df.to_parquet(tmp_path, index=False, row_group_size=ROW_GROUP_SIZE * 10))
+
+
+def author_history_parts(network):
+    # hidden temp files from atomic_write don't match
+    return sorted(glob.glob(os.path.join(author_history_path(network), "part-*.parquet")))
+
+
+def write_author_history_part(network, df):
+    file_path = os.path.join(author_history_path(network), f"part-{time.time_ns()}-{os.getpid()}.parquet")
+
+    return atomic_write(
+        file_path, lambda tmp_path: df.to_parquet(tmp_path, index=False, row_group_size=ROW_GROUP_SIZE * 10))
+
+
+def migrate_author_history(network):
+    # the single file written before parts becomes the first part
+    legacy_path = legacy_author_history_path(network)
+    if os.path.isfile(legacy_path):
+        os.makedirs(author_history_path(network), exist_ok=True)
+        os.replace(legacy_path, os.path.join(author_history_path(network), "part-0.parquet"))
+
+
+def read_author_history(network, heights, columns=None):
+    with file_lock(author_history_path(network)):
+        migrate_author_history(network)
+
+        parts = author_history_parts(network)
+        if not parts or len(heights) == 0:
+            return pd.DataFrame(columns=columns or AUTHOR_COLUMNS)
+
+        df = pd.read_parquet(
+            author_history_path(network), columns=columns,
+            filters=[("height", "in", [int(height) for height in heights])])
+
+    # heights fetched by two syncs at once can sit in two parts
+    keys = [key for key in ["height", "id"] if key in df.columns]
+    return df.drop_duplicates(subset=keys, keep="last") if len(keys) == 2 else df
+
+
+def append_author_history(network, df):
+    # each chunk goes into a new part instead of rewriting the whole history, so a sync's
+    # I/O follows the heights it fetched; parts are merged once there are too many of them
+    if df.empty:
+        return None
+
+    with file_lock(author_history_path(network)):
+        migrate_author_history(network)
+        os.makedirs(author_history_path(network), exist_ok=True)
+        file_path = write_author_history_part(network, df[AUTHOR_COLUMNS])
+
+        parts = author_history_parts(network)
+        if len(parts) > AUTHOR_PARTS_MAX:
+            merged = pd.concat([pd.read_parquet(part) for part in parts])
+            merged = merged.drop_duplicates(subset=["height", "id"], keep="last").sort_values(by=["height", "id"])
+            file_path = write_author_history_part(network, merged)
+            for part in parts:
+                os.remove(part)
+
+            logging.info(f">> merged {len(parts)} {network} author history parts")
+
+    return file_path
+
+
+def read_author_stats(network):
+    file_path = author_stats_path(network)
+    if not os.path.isfile(file_path):
+        return pd.DataFrame(columns=["from_height", "height"])
+
+    return pd.read_parquet(file_path)
+
+
+def append_author_stats(network, df):
+    return append_table(author_stats_path(network), df, ["from_height", "height"])
+
+
+def migrate_json_snapshots(network, frequency):
+    # every session and the refresher can reach a legacy file, the first to take its lock
+    # migrates it and the rest find the parquet file once they get the lock
+    json_path = json_snapshot_path(network, frequency)
+    with file_lock(json_path):
+        file_path = snapshot_path(network, frequency)
+        if os.path.isfile(file_path) or not os.path.isfile(json_path):
+            return file_path
+
+        with open(json_path, "r") as openfile:
+            df = flatten_snapshots(json.load(openfile), frequency)
+
+        write_snapshots(network, frequency, df)
+        os.remove(json_path)
+
+    logging.info(f">> migrated {json_path} to {file_path}")
+
+    return file_path
+
+
+def migrate_all_json_snapshots():
+    for frequency in FREQUENCIES:
+        for json_path in glob.glob(os.path.join(SNAPSHOTS_DIR, frequency, "*.json")):
+            network = os.path.splitext(os.path.basename(json_path))[0]
+            if network in config.deployments:
+                migrate_json_snapshots(network, frequency)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    migrate_all_json_snapshots()